@@ -1,31 +1,38 @@
 #!/usr/bin/env python
 
 import os
+import time
 import logging
+import sqlite3
 import argparse
 
 from openpyxl import load_workbook
 
-from platero.platero import config, db_init, db, db_reset
+from platero.platero import config, db_init, db, db_reset, db_backup, db_restore
 from platero.commands import CliCommand
 from platero.model.models import Protein, BatchProtein, PROTEIN_ID_REGEX
-from platero.model.utils import update_or_create
-from platero.parsing.parsing import read_excel_list
-from platero.utils import filter_digits, assert_empty_df
+from platero.model.utils import bulk_upsert
+from platero.parsing.parsing import read_sheet_list
+from platero.utils import filter_digits, assert_empty_df, file_hash
 
+# NOTE: increase whenever the import of the proteins list or the database
+# schema changes, so the old snapshots are not used anymore
+SNAPSHOT_VERSION = 2
 
-def import_batch_sheet(filename, sheet, mapping, expected_ids):
+
+def import_batch_sheet(worksheet, mapping, expected_ids):
     '''
     Import a batch sheet validating the data and checking that the
     included ids are part of the reference protein list
     '''
-    logging.info("Importing batch sheet '%s' from %s" % (sheet, filename))
+    sheet = worksheet.title
+    logging.info("Importing batch sheet '%s'" % sheet)
     batch_id = filter_digits(sheet)
     batch_name = sheet[len('batch'):].strip()
 
 
     # Import batch proteins
-    df_batch = read_excel_list(filename, sheet, mapping)
+    df_batch = read_sheet_list(worksheet, mapping)
     df_batch['id'] = df_batch['id'].str.upper()
     df_batch['symbol'].fillna(df_batch.id, inplace=True)
     # TODO: remove those not cloned?
@@ -46,11 +53,7 @@ def import_batch_sheet(filename, sheet, mapping, expected_ids):
     assert_empty_df(df_unexpected_id, "Some of the provided ids in sheet '{}' are not in the reference protein list".format(sheet), ['#', 'id'])
 
     # Update the protein info with id, nickname, subfamily and symbol
-    proteins = df_batch.to_dict(orient='records')
-    for protein in proteins:
-        db.query(Protein).\
-        filter(Protein.id == protein['id']).\
-        update({k: protein[k] for k in ('subfamily', 'symbol', 'nickname')})
+    bulk_upsert(db, Protein, df_batch[['id', 'subfamily', 'symbol', 'nickname']])
     db.commit()
 
     # Import the batch info
@@ -60,21 +63,25 @@ def import_batch_sheet(filename, sheet, mapping, expected_ids):
     df_batch_proteins['batch_name'] = batch_name
     df_batch_proteins['batch_id'] = batch_id
     df_batch_proteins['order'] = df_batch_proteins.index
-    batch_proteins = df_batch_proteins.to_dict(orient='records')
-    db.execute(BatchProtein.__table__.insert(), batch_proteins)
+    inserted, updated = bulk_upsert(db, BatchProtein, df_batch_proteins)
+    logging.debug("Imported %d new and %d existing batch proteins" % (inserted, updated))
 
 
-def get_batch_sheets(filename):
-    return [sheet for sheet in load_workbook(filename).get_sheet_names() if sheet.strip().lower().startswith("batch") ]
+def get_batch_sheets(workbook):
+    return [sheet for sheet in workbook.get_sheet_names() if sheet.strip().lower().startswith("batch") ]
 
 
 def init_db(proteins_list):
     db_reset()
 
+    # NOTE: the workbook is opened once, and the sheets are streamed
+    wb = load_workbook(proteins_list, read_only=True)
+    start = time.time()
+
     # Import proteins list
     mapping = {'A':'family', 'C': 'id', 'I':'symbol',
                'J': 'long_symbol', 'K': 'description'}
-    df_proteins = read_excel_list(proteins_list, 'Proteins List', mapping)
+    df_proteins = read_sheet_list(wb.get_sheet_by_name('Proteins List'), mapping)
     df_proteins['id'] = df_proteins['id'].str.upper()
     df_proteins['symbol'].fillna(df_proteins.id, inplace=True)
 
@@ -89,19 +96,75 @@ def init_db(proteins_list):
     assert_empty_df(df_no_family, "Some of the proteins in the reference list don't have an assigned family")
 
     # Insert proteins into DB
-    proteins = df_proteins.to_dict(orient='records')
-    db.execute(Protein.__table__.insert(), proteins)
+    inserted, updated = bulk_upsert(db, Protein, df_proteins)
+    logging.debug("Imported %d new and %d existing proteins" % (inserted, updated))
+    logging.info("Imported sheet 'Proteins List' in %.2f s" % (time.time() - start))
 
     # Import batch sheets
     mapping = {'A': '#', 'B':'subfamily', 'C': 'id', 'D':'symbol',
                'E': 'nickname', 'J': 'cloned'}
 
-    for sheet in get_batch_sheets(proteins_list.name):
-        import_batch_sheet(proteins_list.name, sheet, mapping, df_proteins.id)
+    for sheet in get_batch_sheets(wb):
+        start = time.time()
+        import_batch_sheet(wb.get_sheet_by_name(sheet), mapping, df_proteins.id)
+        logging.info("Imported sheet '%s' in %.2f s" % (sheet, time.time() - start))
 
     db.commit()
 
 
+def snapshot_path(filepath):
+    ''' Location of the database snapshot for a proteins list file '''
+    name = "proteins_{}_v{}.db".format(file_hash(filepath), SNAPSHOT_VERSION)
+    return os.path.join(config.DB_SNAPSHOT_FOLDER, name)
+
+
+def save_snapshot(filepath):
+    ''' Store the imported proteins list as a database snapshot '''
+    if config.DB_SNAPSHOTS:
+        db_backup(snapshot_path(filepath))
+        prune_snapshots(config.DB_SNAPSHOT_FOLDER, config.DB_SNAPSHOTS_MAX_COUNT)
+
+
+def prune_snapshots(folder, max_count):
+    ''' Remove the least recently used snapshots over the maximum count '''
+    snapshots = []
+    for name in os.listdir(folder):
+        if name.startswith('proteins_') and name.endswith('.db'):
+            try:
+                snapshots.append((os.stat(os.path.join(folder, name)).st_mtime, name))
+            except FileNotFoundError:
+                continue
+
+    for _, name in sorted(snapshots, reverse=True)[max_count:]:
+        try:
+            os.remove(os.path.join(folder, name))
+            logging.debug("Removed database snapshot {}".format(name))
+        except FileNotFoundError:
+            pass
+
+
+def load_db(filepath):
+    '''
+    Import a proteins list into the database. If the same file has already
+    been imported, the database snapshot of that import is restored instead
+    '''
+    snapshot = snapshot_path(filepath) if config.DB_SNAPSHOTS else None
+
+    if snapshot and os.path.isfile(snapshot):
+        try:
+            db_restore(snapshot)
+            # Keep track of the last usage for the pruning
+            os.utime(snapshot, None)
+            logging.info("Restored proteins list database from {}".format(snapshot))
+            return
+        except sqlite3.DatabaseError as exc:
+            logging.warning("Invalid database snapshot ({}), the proteins list will be imported: {}".format(snapshot, exc))
+
+    with open(filepath, 'rb') as file:
+        init_db(file)
+    save_snapshot(filepath)
+
+
 class InitDatabase(CliCommand):
     short_description = "Initialize platero database"
 
@@ -116,6 +179,7 @@ class InitDatabase(CliCommand):
     @classmethod
     def _main(cls, args):
         init_db(args.proteins_list)
+        save_snapshot(args.proteins_list.name)
 
 
 if __name__ == '__main__':
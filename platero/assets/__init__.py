@@ -5,4 +5,21 @@ import os
 ASSETS_DIR = os.path.abspath(os.path.dirname(__file__))
 
 SCREEN_PLATE_TEMPLATE = os.path.join(ASSETS_DIR, 'xls_templates', '96wp_screen_template.xlsx')
-STORAGE_PLATE_TEMPLATE = os.path.join(ASSETS_DIR, 'xls_templates', '96wp_storage_template.xlsx')
\ No newline at end of file
+STORAGE_PLATE_TEMPLATE = os.path.join(ASSETS_DIR, 'xls_templates', '96wp_storage_template.xlsx')
+
+# NOTE: the 384 and 1536 well templates are generated from the 96 well ones,
+# see templates.scale_template
+def xls_template_path(kind, size=96):
+    return os.path.join(ASSETS_DIR, 'xls_templates', '{}wp_{}_template.xlsx'.format(size, kind))
+
+def xls_template(kind, size=96):
+    """ Workbook template for a type of plate ('screen' or 'storage') and number of wells """
+    filepath = xls_template_path(kind, size)
+    if not os.path.isfile(filepath):
+        raise FileNotFoundError("No {} template available for {} well plates".format(kind, size))
+
+    return filepath
+
+def xls_template_sizes(kind, sizes):
+    """ Numbers of wells, out of the given ones, with a template available for a type of plate """
+    return [size for size in sizes if os.path.isfile(xls_template_path(kind, size))]
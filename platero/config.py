@@ -1,5 +1,6 @@
 import os
 import logging
+from collections import OrderedDict
 
 class BaseConfig(object):
     APP_TITLE = 'Platero'
@@ -11,6 +12,45 @@ class BaseConfig(object):
     DEBUG = False
 
     LOG_FOLDER = os.path.join(PROJECT_ROOT, 'log')
+    CACHE_FOLDER = os.path.join(PROJECT_ROOT, 'cache')
+    # Database snapshots of the imported proteins lists
+    DB_SNAPSHOTS = False
+    DB_SNAPSHOT_FOLDER = os.path.join(CACHE_FOLDER, 'db')
+    # Snapshots kept, the least recently used ones are removed
+    DB_SNAPSHOTS_MAX_COUNT = 5
+
+    SQLITE_FILE = None
+    SQLALCHEMY_DB = 'sqlite://'
+    SQLALCHEMY_ECHO = False
+    # Pragmas set on every new database connection
+    SQLITE_PRAGMAS = OrderedDict([
+        ('foreign_keys', 'ON'),
+    ])
+
+    # Persistent cache of parsed plate reader files
+    READS_CACHE = False
+    READS_CACHE_FOLDER = os.path.join(CACHE_FOLDER, 'reads')
+    READS_CACHE_MAX_SIZE = 512 * 1024 * 1024
+
+    # Read value for the kinetic time to threshold (None for half of the max signal)
+    KINETICS_THRESHOLD = None
+
+    # File format of the exported results: xlsx, xls (legacy format), or one
+    # of the columnar formats: parquet, feather or hdf5
+    EXPORT_FORMAT = 'xlsx'
+
+    # Additional exports of the results, as (suffix, column, cutoff). Normalized
+    # values of interactions with the column under the cutoff are set to 0
+    EXPORT_THRESHOLDS = [
+        ('4xSTD', 'Z_Score_Old', 4),
+        ('6xSTD', 'Z_Score_Old', 6),
+        ('4xSTD_plate', 'Z_Score_Old_Plate', 4),
+        ('6xSTD_plate', 'Z_Score_Old_Plate', 6),
+        ('Z4_plate', 'Z_Score_Plate', 4),
+        ('Z6_plate', 'Z_Score_Plate', 6),
+        ('Z4', 'Z_Score', 4),
+        ('Z6', 'Z_Score', 6),
+    ]
 
 class DefaultConfig(BaseConfig):
     LOG_FILE = os.path.join(BaseConfig.LOG_FOLDER, 'platero.log')
@@ -19,6 +59,18 @@ class DefaultConfig(BaseConfig):
     SQLITE_FILE = os.path.join(BaseConfig.PROJECT_ROOT, 'db/platero.db')
     SQLALCHEMY_DB = "sqlite:///{}".format(SQLITE_FILE)
     SQLALCHEMY_ECHO = False
+    SQLITE_PRAGMAS = OrderedDict([
+        ('foreign_keys', 'ON'),
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        # Negative values are in KiB (i.e. 64 MB)
+        ('cache_size', -64000),
+        ('mmap_size', 256 * 1024 * 1024),
+        ('temp_store', 'MEMORY'),
+    ])
+
+    READS_CACHE = True
+    DB_SNAPSHOTS = True
 
 class DebugConfig(DefaultConfig):
     DEBUG = True
@@ -33,3 +85,16 @@ class TestConfig(BaseConfig):
 
     SQLALCHEMY_DB = 'sqlite:///:memory:'
 
+
+CONFIGS = {
+    'default': DefaultConfig,
+    'debug': DebugConfig,
+    'test': TestConfig,
+}
+
+def get_config(name='default'):
+    """ Config object for one of the available config names """
+    try:
+        return CONFIGS[name]()
+    except KeyError:
+        raise ValueError("Unknown config '{}', use one of: {}".format(name, ', '.join(sorted(CONFIGS))))
@@ -0,0 +1,249 @@
+"""
+Export of the screen results
+"""
+import importlib.util
+import logging
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+# Maximum number of rows per sheet
+XLS_MAX_ROWS = 65536
+XLSX_MAX_ROWS = 1048576
+
+# Data frame method and library needed by each of the columnar formats
+COLUMNAR_REQUIREMENTS = {
+    'parquet': ('to_parquet', 'pyarrow'),
+    'feather': ('to_feather', 'pyarrow'),
+    'hdf5': ('to_hdf', 'tables'),
+}
+
+# Columns stored as categories in the columnar formats
+CATEGORICAL_COLUMNS = ['Bait', 'Prey', 'BaitId', 'PreyId', 'BaitFamily', 'BaitSubfamily',
+                       'PreyFamily', 'PreySubfamily', 'PlateCell']
+
+
+class Crosstab(object):
+    """
+    Layout of the screen table as a preys vs baits matrix. The pivot index is
+    computed once, so the matrix for any column of values (e.g. the normalized
+    values after applying different thresholds) can be built cheaply.
+    """
+    index_columns = ['PreyFamily', 'PreySubfamily', 'Prey']
+    header_columns = ['BaitFamily', 'BaitSubfamily', 'Bait']
+
+    def __init__(self, df):
+        # NOTE: as in pivot_table, interactions with missing keys are left out
+        self.valid = df[self.index_columns + self.header_columns].notnull().all(axis=1).values
+
+        row_keys = list(zip(*[df[column].values[self.valid] for column in self.index_columns]))
+        column_keys = list(zip(*[df[column].values[self.valid] for column in self.header_columns]))
+
+        self.rows = sorted(set(row_keys))
+        self.columns = sorted(set(column_keys))
+
+        row_codes = codes(row_keys, self.rows)
+        column_codes = codes(column_keys, self.columns)
+        self.cells = row_codes * len(self.columns) + column_codes
+
+    @property
+    def shape(self):
+        return len(self.rows), len(self.columns)
+
+    def matrix(self, values):
+        """
+        Mean of the values for each prey and bait, NaN if not available. Values
+        must be aligned with the rows of the data frame used for the layout
+        """
+        values = np.asarray(values, dtype=float)[self.valid]
+        available = ~np.isnan(values)
+        size = len(self.rows) * len(self.columns)
+
+        sums = np.bincount(self.cells[available], weights=values[available], minlength=size)
+        counts = np.bincount(self.cells[available], minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+
+        return means.reshape(self.shape)
+
+    def dropna(self, matrix):
+        """
+        Preys (rows), baits (columns) and values of a matrix without the preys
+        and baits that have no values at all, as left out by pivot_table
+        """
+        available = ~np.isnan(matrix)
+        keep_rows = available.any(axis=1)
+        keep_columns = available.any(axis=0)
+
+        rows = [row for row, keep in zip(self.rows, keep_rows) if keep]
+        columns = [column for column, keep in zip(self.columns, keep_columns) if keep]
+
+        return rows, columns, matrix[keep_rows][:, keep_columns]
+
+    def frame(self, values):
+        """
+        Crosstab data frame for the values, same as a pivot_table of the screen
+        table on the crosstab index and header columns
+        """
+        rows, columns, matrix = self.dropna(self.matrix(values))
+        index = pd.MultiIndex.from_tuples(rows, names=self.index_columns)
+        columns = pd.MultiIndex.from_tuples(columns, names=self.header_columns)
+
+        return pd.DataFrame(matrix, index=index, columns=columns)
+
+
+def crosstab_rows(crosstab, matrix, fill_value=0, as_text=False):
+    """
+    Cells of the crosstab sheet, row by row: 3 header rows with the family,
+    subfamily and label of the baits, followed by a row for each prey with
+    its family, subfamily, label and values (see Crosstab.matrix). Missing
+    values are replaced by fill_value, and values are converted to text if
+    requested. Preys and baits without any value are left out.
+    """
+    preys, baits, matrix = crosstab.dropna(matrix)
+    matrix = np.where(np.isnan(matrix), fill_value, matrix)
+
+    baits = list(zip(*baits)) if baits else [(), (), ()]
+    yield [None, None, 'BaitFamily'] + list(baits[0])
+    yield [None, None, 'BaitSubfamily'] + list(baits[1])
+    yield ['PreyFamily', 'PreySubfamily', 'Prey vs Bait'] + list(baits[2])
+
+    for prey, prey_values in zip(preys, matrix.tolist()):
+        if as_text:
+            prey_values = [str(value) for value in prey_values]
+        yield list(prey) + prey_values
+
+
+def codes(keys, labels):
+    """ Position of each of the keys in a list of unique labels """
+    positions = {label: i for i, label in enumerate(labels)}
+    return np.array([positions[key] for key in keys], dtype=int)
+
+
+def threshold_values(df, values, column, cutoff):
+    """
+    Values with 0s in place of the interactions where the given column is
+    under the cutoff
+    """
+    return np.where(df[column].values < cutoff, 0, values)
+
+
+def table_rows(df, chunk_size=10000):
+    """
+    Cells of a data frame exported as a sheet, row by row: a header row with
+    the column names followed by the values (None for the missing ones).
+    Values are converted in chunks to keep the memory use bounded.
+    """
+    yield list(df.columns)
+
+    for start in range(0, len(df), chunk_size):
+        values = df.iloc[start:start + chunk_size].values.astype(object)
+        values[pd.isnull(values)] = None
+        for row in values.tolist():
+            yield row
+
+
+def write_xlsx(filename, sheets, max_rows=XLSX_MAX_ROWS):
+    """
+    Stream rows into an xlsx file with a write-only workbook, so the file is
+    never fully built in memory.
+
+    :param sheets: list of (sheet name, rows, number of header rows). When a
+        sheet is full, the rows continue in a new sheet ("<name> (2)", ...)
+        that starts with the same header rows
+    """
+    wb = Workbook(write_only=True)
+
+    for name, rows, n_header in sheets:
+        rows = iter(rows)
+        header = [next(rows) for _ in range(n_header)]
+
+        part = 1
+        ws = wb.create_sheet(title=name)
+        for row in header:
+            ws.append(row)
+        n_rows = n_header
+
+        for row in rows:
+            if n_rows == max_rows:
+                part += 1
+                logging.debug("Sheet '{}' is full, continuing in part {}".format(name, part))
+                ws = wb.create_sheet(title='{} ({})'.format(name, part))
+                for header_row in header:
+                    ws.append(header_row)
+                n_rows = n_header
+            ws.append(row)
+            n_rows += 1
+
+    wb.save(filename)
+
+
+def categorical_table(df):
+    """ Copy of a data frame with the id, label and family columns as categories """
+    df = df.copy()
+    for column in CATEGORICAL_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('category')
+
+    return df
+
+
+def crosstab_columnar(crosstab, matrix, fill_value=0):
+    """
+    Crosstab as a flat data frame for the columnar formats: the prey family,
+    subfamily and label columns, followed by a column per bait named as
+    "<BaitFamily>/<BaitSubfamily>/<Bait>". Preys and baits without any value
+    are left out.
+    """
+    rows, columns, matrix = crosstab.dropna(matrix)
+    matrix = np.where(np.isnan(matrix), fill_value, matrix)
+    preys = list(zip(*rows)) if rows else [(), (), ()]
+    baits = ['/'.join(str(level) for level in bait) for bait in columns]
+
+    df = pd.DataFrame(matrix, columns=baits)
+    for i, column in enumerate(crosstab.index_columns):
+        df.insert(i, column, pd.Categorical(preys[i]))
+
+    return df
+
+
+def columnar_format_available(export_format):
+    """
+    Check if a columnar format can be written with the installed pandas
+    (parquet and feather need pandas >= 0.21) and optional libraries
+    """
+    method, library = COLUMNAR_REQUIREMENTS[export_format]
+    return hasattr(pd.DataFrame, method) and importlib.util.find_spec(library) is not None
+
+
+def write_columnar(path, export_format, table, crosstab, matrix):
+    """
+    Write the results table and the crosstab matrix to a columnar format.
+    Parquet and feather files are written as <path>.<format> for the table and
+    <path>_crosstab.<format> for the crosstab, HDF5 as a single <path>.h5 file
+    with a 'table' and a 'crosstab' key.
+    """
+    if export_format in COLUMNAR_REQUIREMENTS and not columnar_format_available(export_format):
+        raise ValueError("The {} format requires pandas >= 0.21 and {}, not installed".format(
+            export_format, COLUMNAR_REQUIREMENTS[export_format][1]))
+
+    ctdf = crosstab_columnar(crosstab, matrix)
+
+    if export_format == 'parquet':
+        table.to_parquet(path + '.parquet', index=False)
+        ctdf.to_parquet(path + '_crosstab.parquet', index=False)
+    elif export_format == 'feather':
+        table.reset_index(drop=True).to_feather(path + '.feather')
+        ctdf.to_feather(path + '_crosstab.feather')
+    elif export_format == 'hdf5':
+        # NOTE: categories are not supported by the fixed format, used for the
+        # crosstab as the table format is limited in number of columns
+        for column in crosstab.index_columns:
+            ctdf[column] = ctdf[column].astype(object)
+
+        with pd.HDFStore(path + '.h5', mode='w') as store:
+            store.put('table', table, format='table')
+            store.put('crosstab', ctdf, format='fixed')
+    else:
+        raise ValueError("Unknown columnar format '{}'".format(export_format))
@@ -0,0 +1,64 @@
+"""
+Kinetic features of the plate reads, computed over all timepoints
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+KINETIC_COLUMNS = ['Slope', 'AUC', 'MaxSignal', 'TimeToThreshold']
+
+def kinetic_features(minutes, values, threshold=None):
+    """
+    Compute the kinetic features of a set of wells at once. Missing reads
+    (NaN) are ignored: the AUC leaves out the segments next to a missing
+    read, and the features of a well without reads are NaN.
+
+    :param minutes: array with the timepoints (in minutes) of the reads
+    :param values: 2D array of reads, one row per timepoint and one column per well
+    :param threshold: read value used for the time to threshold. If not given, half
+        of the maximum signal of each well is used
+    :return: ordered dictionary with an array of values per feature (see KINETIC_COLUMNS)
+    """
+    minutes = np.asarray(minutes, dtype=float)
+    values = np.asarray(values, dtype=float).reshape(len(minutes), -1)
+    valid = ~np.isnan(values)
+    n_valid = valid.sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Least squares slope, ignoring missing reads
+        times = np.where(valid, minutes[:, np.newaxis], 0)
+        reads = np.where(valid, values, 0)
+        time_mean = times.sum(axis=0) / n_valid
+        read_mean = reads.sum(axis=0) / n_valid
+        time_dev = np.where(valid, times - time_mean, 0)
+        slope = (time_dev * (reads - read_mean)).sum(axis=0) / (time_dev ** 2).sum(axis=0)
+
+        # Area under the curve (trapezoidal rule), over the segments between 2 reads
+        segments = np.diff(minutes)[:, np.newaxis] * (values[1:] + values[:-1]) / 2
+        valid_segments = valid[1:] & valid[:-1]
+        auc = np.where(n_valid > 0, np.where(valid_segments, segments, 0).sum(axis=0), np.nan)
+
+        max_signal = np.where(n_valid > 0, np.where(valid, values, -np.inf).max(axis=0), np.nan)
+
+        # Time of the first read over the threshold
+        thresholds = max_signal / 2 if threshold is None else np.full(values.shape[1], threshold)
+        above = values >= thresholds
+        first_above = above.argmax(axis=0)
+        time_to_threshold = np.where(above.any(axis=0), minutes[first_above], np.nan)
+
+    features = OrderedDict()
+    features['Slope'] = slope
+    features['AUC'] = auc
+    features['MaxSignal'] = max_signal
+    features['TimeToThreshold'] = time_to_threshold
+
+    return features
+
+
+def plate_kinetics(reads, cells, threshold=None):
+    """
+    Kinetic features for the given cells of a plate, from the reads data
+    frame of a plate (see parsing.parse_plate_results)
+    """
+    minutes = np.array([(t.hour * 3600 + t.minute * 60 + t.second) / 60.0 for t in reads['Time']])
+    return kinetic_features(minutes, reads.loc[:, list(cells)].values, threshold)
@@ -0,0 +1,127 @@
+"""
+Declarative plate layouts: the regions of a plate that hold the proteins,
+the order in which they are filled and where the controls go. A layout is
+compiled once per plate geometry into index arrays, so filling a plate is a
+single assignment of codes (see wellplate.WellPlate).
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# Region of a plate, as (start, stop) fractions of its rows and columns
+Region = namedtuple('Region', ['rows', 'columns'])
+
+# Control value placed at a slot of the fill order of the regions (negative
+# slots count from the end), either in every region holding proteins
+# ('filled') or in the last region of the plate ('last'). The layers are the
+# values of the wells set to the control (e.g. only the prey of a screen well)
+Control = namedtuple('Control', ['value', 'slot', 'regions', 'layers'])
+
+WHOLE_PLATE = [Region(rows=(0, 1), columns=(0, 1))]
+HALVES = [Region(rows=(0, 1), columns=(0, 0.5)), Region(rows=(0, 1), columns=(0.5, 1))]
+
+
+class PlateLayout(object):
+    """
+    Layout of the proteins of a plate.
+
+    :param regions: list of Region
+    :param fill: order of the wells in each region, 'columns' (column by column)
+        or 'rows' (row by row)
+    :param unit: wells taken by each protein: a 'well' of each region (i.e. the
+        regions are replicates), a whole 'line' (column or row, depending on the
+        fill order) or a whole 'region'
+    :param reserved: wells kept free at the end of each region (well units only)
+    :param controls: list of Control
+    """
+    def __init__(self, regions, fill='columns', unit='well', reserved=0, controls=()):
+        if fill not in ('columns', 'rows'):
+            raise ValueError("Invalid fill order '{}'".format(fill))
+        if unit not in ('well', 'line', 'region'):
+            raise ValueError("Invalid layout unit '{}'".format(unit))
+
+        self.regions = regions
+        self.fill = fill
+        self.unit = unit
+        self.reserved = reserved
+        self.controls = list(controls)
+        self._compiled = {}
+
+    def compile(self, geometry):
+        """ Layout index arrays for a plate geometry, compiled on first use """
+        if geometry not in self._compiled:
+            self._compiled[geometry] = CompiledLayout(self, geometry)
+
+        return self._compiled[geometry]
+
+
+class CompiledLayout(object):
+    """
+    Index arrays of a layout for a plate geometry. Slots are the groups of
+    wells taken by each protein, in fill order.
+    """
+    def __init__(self, layout, geometry):
+        self.layout = layout
+        lines = [region_lines(geometry, region, layout.fill) for region in layout.regions]
+        self.region_wells = [region.ravel() for region in lines]
+
+        if layout.unit == 'well':
+            size = min(len(wells) for wells in self.region_wells) - layout.reserved
+            self.slots = np.stack([wells[:size] for wells in self.region_wells], axis=1)
+            first_slots = np.zeros(len(lines), dtype=int)
+        elif layout.unit == 'line':
+            self.slots = np.concatenate(lines)
+            first_slots = np.cumsum([0] + [len(region) for region in lines[:-1]])
+        else:
+            self.slots = np.stack(self.region_wells)
+            first_slots = np.arange(len(lines))
+
+        # First slot of each region, to know which regions are filled
+        self.first_slots = np.asarray(first_slots)
+        self.capacity = len(self.slots)
+
+        # Well of each control in each of the regions
+        self.control_wells = [np.array([wells[control.slot] for wells in self.region_wells])
+                              for control in layout.controls]
+
+    def fill(self, codes, item_codes, start=0):
+        """
+        Set the codes of the wells of a plate for the given item codes, one
+        per slot starting at the given slot
+        """
+        slots = self.slots[start:start + len(item_codes)]
+        # NOTE: a reshaped view, as assignments through flat don't broadcast
+        wells = codes.reshape(-1)
+        wells[slots] = np.asarray(item_codes)[:len(slots), np.newaxis]
+
+    def filled_regions(self, n_items):
+        """ Mask of the regions holding some of the first n items """
+        return self.first_slots < n_items
+
+    def filled_wells(self, n_items):
+        """ Wells of the regions holding some of the first n items """
+        filled = self.filled_regions(n_items)
+        return np.concatenate([wells for wells, is_filled in zip(self.region_wells, filled) if is_filled])
+
+    def controls(self, n_items):
+        """ List of (control, wells) for a plate with n items """
+        filled = self.filled_regions(n_items)
+        controls = []
+        for control, wells in zip(self.layout.controls, self.control_wells):
+            controls.append((control, wells[filled] if control.regions == 'filled' else wells[-1:]))
+
+        return controls
+
+
+def region_lines(geometry, region, fill):
+    """
+    Flat indexes of the wells of a region, as an array with a line (column
+    or row, depending on the fill order) per row
+    """
+    n_rows, n_columns = geometry.shape
+    rows = np.arange(int(round(region.rows[0] * n_rows)), int(round(region.rows[1] * n_rows)))
+    columns = np.arange(int(round(region.columns[0] * n_columns)), int(round(region.columns[1] * n_columns)))
+
+    if fill == 'columns':
+        return geometry.flat_index(rows[np.newaxis, :], columns[:, np.newaxis])
+    return geometry.flat_index(rows[:, np.newaxis], columns[np.newaxis, :])
@@ -0,0 +1,56 @@
+import pandas as pd
+
+from .models import Protein, BatchProtein
+
+
+class ProteinCatalog(object):
+    """
+    Read-only snapshot of the batch proteins in the database. It doesn't
+    hold any database session, so it can be shared with worker processes.
+    """
+    def __init__(self, proteins, batches):
+        # Data frame indexed by protein id, with Label, Family and Subfamily
+        self.proteins = proteins
+        # batch_id -> frozenset(protein_id)
+        self.batches = batches
+
+    @classmethod
+    def from_db(cls, db):
+        """ Load the catalog from the database with a single query """
+        rows = db.query(BatchProtein.batch_id, Protein.id, Protein.symbol, Protein.family, Protein.subfamily).\
+            join(Protein, BatchProtein.protein_id == Protein.id).all()
+        df = pd.DataFrame(rows, columns=['BatchId', 'Id', 'Symbol', 'Family', 'Subfamily'])
+
+        batches = {int(batch_id): frozenset(ids) for batch_id, ids in df.groupby('BatchId').Id}
+
+        proteins = df.drop_duplicates(subset='Id').set_index('Id')
+        # NOTE: same as Protein.label
+        symbols = proteins.Symbol.fillna('')
+        proteins['Label'] = symbols.where(symbols != '', proteins.index.to_series())
+
+        return cls(proteins[['Label', 'Family', 'Subfamily']], batches)
+
+    def batch_proteins(self, batch_id):
+        """ Ids of the proteins in a batch (empty if the batch doesn't exist) """
+        return self.batches.get(int(batch_id), frozenset())
+
+    def missing_from_batch(self, protein_ids, batch_id):
+        """ Sorted list of the given protein ids not found in a batch """
+        return sorted(set(protein_ids) - self.batch_proteins(batch_id))
+
+    def annotate(self, df):
+        """
+        Add the labels, families and subfamilies of the baits and preys to a
+        screen table, joining on the BaitId and PreyId columns
+        """
+        bait_info = self.proteins.reindex(df.BaitId)
+        prey_info = self.proteins.reindex(df.PreyId)
+
+        df['Bait'] = bait_info.Label.values
+        df['Prey'] = prey_info.Label.values
+        df['BaitFamily'] = bait_info.Family.values
+        df['BaitSubfamily'] = bait_info.Subfamily.values
+        df['PreyFamily'] = prey_info.Family.values
+        df['PreySubfamily'] = prey_info.Subfamily.values
+
+        return df
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, Float, Text, DateTime
+from collections import namedtuple
+
+from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, Float, Text, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -31,6 +33,17 @@ class Protein(BaseModel):
         return self.symbol if self.symbol else self.id
 
 
+class ProteinRow(namedtuple('ProteinRow', ['id', 'symbol', 'nickname', 'family', 'subfamily'])):
+    """
+    Read-only values of a protein, for the callers that don't need ORM objects
+    """
+    __slots__ = ()
+
+    @property
+    def label(self):
+        return self.symbol if self.symbol else self.id
+
+
 class BatchProtein(BaseModel):
     __tablename__ = 'batch_protein'
 
@@ -49,6 +62,13 @@ class BatchProtein(BaseModel):
 
     protein = relationship(Protein)
 
+    __table_args__ = (
+        # Batch proteins by batch (get_batch_proteins)
+        Index('ix_batch_protein_batch', 'batch_id', 'cloned', 'order'),
+        # Membership of a protein in a batch
+        Index('ix_batch_protein_protein', 'protein_id', 'batch_id'),
+    )
+
 
 class Plate(BaseModel):
     __tablename__ = 'plate'
@@ -62,6 +82,11 @@ class Plate(BaseModel):
 
     cells = relationship("PlateCell", cascade="all, delete, delete-orphan", backref="plate")
 
+    __table_args__ = (
+        # Plates of a batch combination (get_plates)
+        Index('ix_plate_batches', 'bait_batch_id', 'prey_batch_id'),
+    )
+
     @property
     def name(self):
         return screen_plate_name(self.id)
@@ -84,4 +109,9 @@ class PlateCell(BaseModel):
     bait = relationship(Protein, foreign_keys=[bait_id])
     prey = relationship(Protein, foreign_keys=[prey_id])
 
+    __table_args__ = (
+        Index('ix_plate_cells_bait', 'bait_id'),
+        Index('ix_plate_cells_prey', 'prey_id'),
+    )
+
 
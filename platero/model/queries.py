@@ -1,21 +1,69 @@
-from .models import Plate, PlateCell, BatchProtein
-from platero.parsing.parsing import iterate96WP
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, subqueryload
+
+from .models import Plate, PlateCell, BatchProtein, Protein, ProteinRow
+from platero.parsing.parsing import iterate_wells
 from platero.platero import db
-from platero.wellplate import POS_CONTROL, NEG_CONTROL
+from platero.wellplate import POS_CONTROL, NEG_CONTROL, get_geometry
+
+PLATE_CELL_COLUMNS = ['plate_id', 'row', 'column', 'bait_id', 'prey_id', 'is_NC', 'is_PC']
+
 
+def batch_proteins_query(query, batch_id):
+    """ Filter a query joined with the batch proteins to the cloned proteins of a batch, in order """
+    return query.filter(BatchProtein.batch_id==batch_id, BatchProtein.cloned=='yes').\
+        order_by(BatchProtein.order)
 
 def get_batch_proteins(batch_id):
-    return [ bp.protein for bp in
-             db.query(BatchProtein).filter(
-                 BatchProtein.batch_id==batch_id, BatchProtein.cloned=='yes'
-             ).order_by(BatchProtein.order)]
+    # NOTE: the proteins are loaded in the same query
+    query = db.query(BatchProtein).options(joinedload(BatchProtein.protein))
+    return [bp.protein for bp in batch_proteins_query(query, batch_id)]
 
-def get_plates(bait_batch_id, prey_batch_id):
-    return db.query(Plate).filter(Plate.bait_batch_id==bait_batch_id,
-                                  Plate.prey_batch_id==prey_batch_id).order_by(Plate.id)
+def get_batch_protein_rows(batch_id):
+    """ Same as get_batch_proteins, as read-only ProteinRow tuples """
+    query = db.query(*[getattr(Protein, field) for field in ProteinRow._fields]).\
+        join(BatchProtein, BatchProtein.protein_id==Protein.id)
+    return [ProteinRow(*row) for row in batch_proteins_query(query, batch_id)]
 
-def save_template(plate_id, template):
-    for (cell, row, col) in iterate96WP():
+def get_plates(bait_batch_id, prey_batch_id, with_cells=False):
+    query = db.query(Plate).filter(Plate.bait_batch_id==bait_batch_id,
+                                   Plate.prey_batch_id==prey_batch_id).order_by(Plate.id)
+    if with_cells:
+        # Cells of all the plates with their proteins, in 2 more queries
+        query = query.options(subqueryload(Plate.cells).joinedload(PlateCell.bait),
+                              subqueryload(Plate.cells).joinedload(PlateCell.prey))
+    return query
+
+def reserve_plate_ids(bait_batch_id, prey_batch_id, n_plates):
+    """
+    Add a number of plates for a pair of batches in a single transaction,
+    returning their ids: a contiguous block after the last plate, the same
+    ids the plates would get if added one by one
+    """
+    first_id = (db.query(func.max(Plate.id)).scalar() or 0) + 1
+    plate_ids = list(range(first_id, first_id + n_plates))
+    if plate_ids:
+        # NOTE: a plain insert, so a block taken meanwhile fails instead of being reused
+        db.execute(Plate.__table__.insert(), [{'id': plate_id, 'bait_batch_id': bait_batch_id,
+                                               'prey_batch_id': prey_batch_id} for plate_id in plate_ids])
+    db.commit()
+
+    return plate_ids
+
+def delete_plates(plate_ids):
+    """ Remove plates without cells (e.g. reserved for templates that failed to render) """
+    if plate_ids:
+        db.query(Plate).filter(Plate.id.in_(plate_ids)).delete(synchronize_session=False)
+    db.commit()
+
+def template_rows(plate_id, template):
+    """
+    Flatten a plate template into plate cell rows, tuples with the values of
+    PLATE_CELL_COLUMNS. Empty cells are left out, and the controls are saved
+    as flags without bait and prey.
+    """
+    rows = []
+    for (cell, row, col) in iterate_wells(get_geometry(len(template))):
         if not template[cell]['prey']:
             continue
 
@@ -27,20 +75,29 @@ def save_template(plate_id, template):
         elif template[cell]['prey']==NEG_CONTROL:
             is_NC = True
         else:
-            bait=template[cell]['bait']
-            prey=template[cell]['prey']
-
-        plate_cell = PlateCell(
-            row=row,
-            column=col,
-            bait=bait,
-            prey=prey,
-            is_NC=is_NC,
-            is_PC=is_PC,
-            plate_id=plate_id
-        )
-        db.add(plate_cell)
+            # Proteins or protein ids
+            bait = getattr(template[cell]['bait'], 'id', template[cell]['bait'])
+            prey = getattr(template[cell]['prey'], 'id', template[cell]['prey'])
 
-    db.commit()
+        rows.append((plate_id, row, col, bait, prey, is_NC, is_PC))
+
+    return rows
+
+def save_templates(templates, chunk_size=None):
+    """
+    Save the cells of several plates in a single transaction, inserting
+    the rows in bulk (in chunks of the given size, if any)
 
+    :param templates: list of (plate id, template) tuples
+    """
+    rows = [row for plate_id, template in templates for row in template_rows(plate_id, template)]
+    chunk_size = chunk_size or len(rows) or 1
 
+    insert = PlateCell.__table__.insert()
+    for start in range(0, len(rows), chunk_size):
+        db.execute(insert, [dict(zip(PLATE_CELL_COLUMNS, row)) for row in rows[start:start + chunk_size]])
+
+    db.commit()
+
+def save_template(plate_id, template):
+    save_templates([(plate_id, template)])
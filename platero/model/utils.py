@@ -1,7 +1,13 @@
 
+import sqlite3
+
+import pandas as pd
 from sqlalchemy.sql.elements import ClauseElement
-from sqlalchemy import Column, DateTime
-from platero.utils import get_current_time
+from sqlalchemy import Column, DateTime, select, text
+from platero.utils import get_current_time, chunks
+
+# NOTE: INSERT ... ON CONFLICT is only available from SQLite 3.24
+SQLITE_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
 
 # TODO: Make methods thread safe?
 def update_or_create(db_session, model, values=None, **kwargs):
@@ -9,9 +15,10 @@ def update_or_create(db_session, model, values=None, **kwargs):
     Update an existing instance of a model if found, or create new
     otherwise
     """
-    instance = db_session.query(model).filter_by(**kwargs).first()
+    query = db_session.query(model).filter_by(**kwargs)
+    instance = query.first()
     if instance:
-        db_session.query(model).filter_by(**kwargs).update(values)
+        query.update(values)
         return instance, False
     else:
         params = dict((k, v) for k, v in kwargs.items() if not isinstance(v, ClauseElement))
@@ -35,6 +42,83 @@ def get_or_create(db_session, model, defaults=None, **kwargs):
         db_session.add(instance)
         return instance, True
 
+def bulk_upsert(db_session, model, rows, update_columns=None, chunk_size=500):
+    """
+    Insert the rows of a model, updating the existing ones (matched by primary
+    key) with a single INSERT ... ON CONFLICT DO UPDATE statement executed for
+    all rows. With SQLite < 3.24 the new rows are inserted and the existing
+    ones updated with separate statements instead.
+
+    :param rows: list of dictionaries or data frame with the column values.
+        All rows must have the same keys, including the primary key
+    :param update_columns: columns updated for the existing rows, by default
+        all the given columns except the primary key
+    :return: tuple with the number of inserted and updated rows
+    """
+    if isinstance(rows, pd.DataFrame):
+        rows = rows.astype(object).where(pd.notnull(rows), None).to_dict(orient='records')
+    if not rows:
+        return 0, 0
+
+    table = model.__table__
+    keys = [column.name for column in table.primary_key]
+    # NOTE: as in the Core inserts, values that aren't table columns are ignored
+    columns = [column for column in rows[0].keys() if column in table.c]
+    if update_columns is None:
+        update_columns = [column for column in columns if column not in keys]
+
+    # NOTE: the column defaults are only used for the new rows
+    defaults = {}
+    for column in table.columns:
+        if column.name not in columns and column.default is not None:
+            if column.default.is_scalar:
+                defaults[column.name] = column.default.arg
+            elif column.default.is_callable:
+                defaults[column.name] = column.default.arg(None)
+    if defaults:
+        rows = [dict(defaults, **row) for row in rows]
+
+    # Count the rows that already exist, in chunks to keep the query small
+    existing = set()
+    key_columns = [table.c[key] for key in keys]
+    for chunk in chunks(list(set(row[keys[0]] for row in rows)), chunk_size):
+        query = select(key_columns).where(key_columns[0].in_(chunk))
+        existing.update(tuple(row) for row in db_session.execute(query))
+
+    new_rows, existing_rows = [], []
+    for row in rows:
+        key = tuple(row[k] for k in keys)
+        if key in existing:
+            existing_rows.append(row)
+        else:
+            new_rows.append(row)
+            existing.add(key)
+
+    quote = db_session.bind.dialect.identifier_preparer.quote
+    insert_columns = columns + sorted(defaults)
+    statement = "INSERT INTO {} ({}) VALUES ({})".format(
+        quote(table.name),
+        ', '.join(quote(column) for column in insert_columns),
+        ', '.join(':{}'.format(column) for column in insert_columns))
+
+    if SQLITE_UPSERT:
+        statement += " ON CONFLICT ({}) ".format(', '.join(quote(key) for key in keys))
+        if update_columns:
+            statement += "DO UPDATE SET " + ', '.join('{0} = excluded.{0}'.format(quote(column)) for column in update_columns)
+        else:
+            statement += "DO NOTHING"
+        db_session.execute(text(statement), rows)
+    else:
+        if new_rows:
+            db_session.execute(text(statement), new_rows)
+        if existing_rows and update_columns:
+            db_session.execute(text("UPDATE {} SET {} WHERE {}".format(
+                quote(table.name),
+                ', '.join('{} = :{}'.format(quote(column), column) for column in update_columns),
+                ' AND '.join('{} = :{}'.format(quote(key), key) for key in keys))), existing_rows)
+
+    return len(new_rows), len(existing_rows)
+
 class TimestampMixin(object):
     """
     A table mixing to add timestamp columns to any entity
@@ -0,0 +1,137 @@
+"""
+Persistent cache of parsed plate reader results
+"""
+import os
+import json
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from .parsing import parse_plate_block, reads_frame
+from platero.utils import file_hash
+
+# NOTE: increase whenever the parsing of the plate reader files changes, so
+# the old cache entries are not used anymore
+PARSER_VERSION = 1
+
+class ReadsCache(object):
+    """
+    Stores the parsed reads of the plate reader files on disk, as numpy
+    archives keyed by the hash of the file contents and the parser version.
+    When the cache grows above its maximum size the least recently used
+    entries are removed.
+    """
+    extension = '.npz'
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+    @classmethod
+    def from_config(cls, config):
+        """ Cache set up from the application config, None if disabled """
+        if not config.READS_CACHE:
+            return None
+
+        return cls(config.READS_CACHE_FOLDER, config.READS_CACHE_MAX_SIZE)
+
+    def key(self, filepath):
+        """ Cache key for a plate reader file """
+        return "{}_v{}".format(file_hash(filepath), PARSER_VERSION)
+
+    def entry_path(self, key):
+        return os.path.join(self.folder, key + self.extension)
+
+    def parse_plate_results(self, filepath):
+        """
+        Same as parsing.parse_plate_results, but reusing the cached reads when
+        the file has already been parsed
+        """
+        key = self.key(filepath)
+        cached = self.load(key)
+        if cached:
+            logging.debug("Using cached reads for {}".format(filepath))
+            block, metadata = cached
+        else:
+            block, metadata = parse_plate_block(filepath)
+            self.save(key, block, metadata)
+
+        return reads_frame(*block), metadata
+
+    def load(self, key):
+        """ Load a cache entry, returning None if not available """
+        path = self.entry_path(key)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                block = (entry['columns'].tolist(), entry['seconds'], entry['values'])
+                metadata = OrderedDict(json.loads(str(entry['metadata'])))
+        except Exception as exc:
+            logging.warning("Invalid reads cache entry ({}), it will be ignored: {}".format(path, exc))
+            return None
+
+        # Keep track of the last usage for the eviction
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            pass
+
+        return block, metadata
+
+    def save(self, key, block, metadata):
+        """ Store a new cache entry and evict the old ones if needed """
+        columns, seconds, values = block
+        path = self.entry_path(key)
+        # NOTE: parallel workers might be storing the same entry
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+
+        try:
+            with open(tmp_path, 'wb') as file:
+                np.savez_compressed(file,
+                                    columns=np.array(columns, dtype=str),
+                                    seconds=seconds.astype(np.int32),
+                                    values=values,
+                                    metadata=np.array(json.dumps(list(metadata.items()))))
+            os.replace(tmp_path, path)
+        except (OSError, TypeError) as exc:
+            logging.warning("Reads couldn't be stored in the cache: {}".format(exc))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used entries until the size limit is met """
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith(self.extension):
+                try:
+                    stat = os.stat(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+                logging.debug("Evicted reads cache entry {}".format(name))
+            except FileNotFoundError:
+                # Already evicted by another process
+                pass
+            total -= size
+
+    def clear(self):
+        """ Remove all the cache entries """
+        for name in os.listdir(self.folder):
+            if name.endswith(self.extension):
+                os.remove(os.path.join(self.folder, name))
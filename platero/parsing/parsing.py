@@ -1,6 +1,8 @@
 
 import pandas as pd
 
+from platero.wellplate import GEOMETRIES, get_geometry
+
 def strip(text):
     try:
         return text.strip()
@@ -17,44 +19,116 @@ def read_excel_list(file, sheet, column_map):
     return df
 
 
-def iterate96WP():
-    for row in 'ABCDEFGH':
-        for col in range(1, 13):
-            yield "{}{}".format(row,col), row, col
+def column_index(letter):
+    """ 0-based index of a spreadsheet column letter (A -> 0, AA -> 26) """
+    index = 0
+    for char in letter.upper():
+        index = index * 26 + ord(char) - ord('A') + 1
+
+    return index - 1
+
+
+def column_letter(index):
+    """ Spreadsheet column letter of a 0-based column index (0 -> A, 26 -> AA) """
+    letter = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letter = chr(ord('A') + remainder) + letter
+
+    return letter
+
+
+def read_sheet_list(worksheet, column_map):
+    """
+    Same as read_excel_list, for a worksheet of an already open workbook (e.g.
+    loaded in read-only mode, streaming the rows). The first row is the header
+    """
+    columns = sorted(column_map.keys(), key=column_index)
+    indices = [column_index(column) for column in columns]
+
+    rows = []
+    for i, row in enumerate(worksheet.iter_rows()):
+        if i == 0:
+            continue
+        values = [strip(row[index].value) if index < len(row) else None for index in indices]
+        rows.append([None if value == '' else value for value in values])
+
+    df = pd.DataFrame(rows, columns=[column_map[key] for key in columns])
+    df.dropna(how='all', inplace=True)
+
+    return df
+
 
+def iterate_wells(geometry):
+    """ Name, row label and column number of the wells of a plate, row by row """
+    for name, i, j in zip(geometry.names, geometry.well_rows.tolist(), geometry.well_columns.tolist()):
+        yield name, geometry.rows[i], j + 1
 
-def reverse(template):
-    """ Reverse a template, in case the plate was put in the wrong direction """
-    reversed = {}
-    rows = 'ABCDEFGH'
-    cols = range(1,13)
-    for i, row in enumerate(rows):
-      for col in cols:
-          cell = "{}{}".format(row, col)
-          reverse_cell = "{}{}".format(rows[-(i+1)], len(cols) - (col - 1))
-          reversed[reverse_cell] = template[cell]
 
-    return reversed
+def iterate96WP():
+    return iterate_wells(GEOMETRIES[96])
+
+
+def reverse(template, geometry=None):
+    """
+    Reverse a template, in case the plate was put in the wrong direction. The
+    plate geometry is guessed from the template size if not given
+    """
+    geometry = geometry or get_geometry(len(template))
+    names = geometry.names
+    return OrderedDict((names[i], template[names[j]]) for i, j in enumerate(geometry.rotation.tolist()))
 
 
 # TODO: maybe do with openpyxl?
+import logging
 import xlrd
+import numpy as np
 from collections import OrderedDict
 import datetime
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
 def parse_plate_results(filepath):
     ''' Parse the raw file coming from the plate reader'''
+    block, metadata = parse_plate_block(filepath)
+
+    return reads_frame(*block), metadata
+
+
+def parse_plate_block(filepath):
+    '''
+    Parse the raw file coming from the plate reader, returning the reads
+    block as arrays (see read_plate_block) and the metadata
+    '''
     book = xlrd.open_workbook(filepath)
     sheet = book.sheet_by_index(0)
 
-    # Parse some metadata at the beginning of the file, until we find the reads
+    header_row = find_header_row(sheet)
+    metadata = parse_plate_metadata(sheet, header_row)
+
+    return read_plate_block(sheet, header_row, filepath), metadata
+
+
+def find_header_row(sheet, label='Time', column=1):
+    '''
+    Find the row where the reads start, i.e. the header of the reads
+    matrix with the timepoints in the given column
+    '''
+    try:
+        return sheet.col_values(column).index(label)
+    except ValueError:
+        raise ValueError("No '{}' header could be found in the plate reads".format(label))
+
+
+def parse_plate_metadata(sheet, header_row):
+    '''
+    Parse the metadata at the beginning of the file, until the reads header
+    '''
     # TODO: date values, hierarchies, empty values, ...
     metadata = OrderedDict()
     tag = None
-    for row_index in range(sheet.nrows):
-        col_0 = sheet.cell(row_index, 0).value
-        col_1 = sheet.cell(row_index, 1).value
-        if col_1 == 'Time':
-            break
+    for col_0, col_1 in zip(sheet.col_values(0, 0, header_row), sheet.col_values(1, 0, header_row)):
         if col_0 and col_1:
             tag = col_0
             metadata[tag] = col_1
@@ -63,21 +137,68 @@ def parse_plate_results(filepath):
         else:
             tag = None
 
-    # Parse reads, grouped by timepoint
+    return metadata
+
+
+def read_plate_block(sheet, header_row, source=None):
+    '''
+    Read the whole reads matrix below the header row in a single block.
+    Returns the column names, the timepoints (as seconds of the day) and
+    a float array with one row per timepoint and one column per read.
+    Non numeric reads (e.g. overflow markers) are logged and set to NaN
+    '''
     # TODO: maybe strip columns?
-    data_cols = sheet.row_values(row_index, 1)
-    data_rows = []
-    while sheet.cell(row_index + 1, 2).value:
-        row_index += 1
-        row_data = sheet.row_values(row_index, 1, len(data_cols) + 1)
-        # Fix timepoint format
-        timepoint = xlrd.xldate_as_tuple(row_data[0], book.datemode)
-        row_data[0] = datetime.time(*timepoint[3:])
-        data_rows.append(row_data)
-
-    reads = pd.DataFrame(data_rows, columns=data_cols)
-
-    return reads, metadata
+    columns = sheet.row_values(header_row, 1)
+
+    # Reads go on until the first empty value after the timepoint column
+    start = header_row + 1
+    first_reads = sheet.col_values(2, start)
+    n_reads = next((i for i, value in enumerate(first_reads) if not value), len(first_reads))
+    end = start + n_reads
+
+    times = np.array(sheet.col_values(1, start, end), dtype=float)
+    values = np.array([sheet.col_values(col, start, end) for col in range(2, len(columns) + 1)],
+                      dtype=object).T.reshape(n_reads, len(columns) - 1)
+    values[values == ''] = np.nan
+    seconds = xldate_to_seconds(times)
+
+    reads = pd.to_numeric(values.ravel(), errors='coerce').astype(float).reshape(values.shape)
+    coerced = np.isnan(reads) & pd.notnull(values)
+    if coerced.any():
+        rows, cols = np.nonzero(coerced)
+        cells = ["{} at {}: {!r}".format(columns[j + 1], time, values[i, j])
+                 for i, j, time in zip(rows, cols, seconds_to_times(seconds[rows]))]
+        logging.warning("Non numeric reads{} set as missing: {}".format(
+            ' in {}'.format(source) if source else '', ', '.join(cells)))
+
+    return columns, seconds, reads
+
+
+def xldate_to_seconds(xldates):
+    '''
+    Vectorized conversion of excel dates to seconds of the day, rounded as
+    in xlrd.xldate_as_tuple
+    '''
+    fractions = xldates - np.floor(xldates)
+    return np.rint(fractions * SECONDS_PER_DAY).astype(int) % SECONDS_PER_DAY
+
+
+def seconds_to_times(seconds):
+    ''' Convert an array of seconds of the day into datetime.time objects '''
+    seconds = np.asarray(seconds)
+    hours, remainder = seconds // 3600, seconds % 3600
+    minutes, secs = remainder // 60, remainder % 60
+    return [datetime.time(*hms) for hms in zip(hours.tolist(), minutes.tolist(), secs.tolist())]
+
+
+def reads_frame(columns, seconds, values):
+    '''
+    Build the reads data frame, grouped by timepoint, from a block of reads
+    '''
+    reads = pd.DataFrame(values, columns=columns[1:])
+    reads.insert(0, columns[0], seconds_to_times(seconds))
+
+    return reads
 
 
 def dump_template(template):
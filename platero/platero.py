@@ -1,57 +1,180 @@
 import os
 import logging
-from sqlalchemy import create_engine
+import sqlite3
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.scoping import scoped_session
+from sqlalchemy.pool import StaticPool
 
-from .config import DefaultConfig
+from .config import get_config
 from .utils import setup_logging
 from .model.models import BaseModel
 
-config = DefaultConfig()
+config = get_config(os.environ.get('PLATERO_CONFIG', 'default'))
 logger = logging.getLogger()
 
-# TODO: More elegant way for db connection handling could be used
-# NOTE: the listener is necessary for SQLite to enforce foreign keys
-from sqlalchemy.interfaces import PoolListener
-class ForeignKeysListener(PoolListener):
-    def connect(self, dbapi_con, con_record):
-        db_cursor = dbapi_con.execute('pragma foreign_keys=ON')
-
-from sqlalchemy.pool import StaticPool
-__db_engine = create_engine('sqlite://',
-                    connect_args={'check_same_thread':False},
-                    poolclass=StaticPool,
-                    listeners=[ForeignKeysListener()],
-                    echo=config.SQLALCHEMY_ECHO)
-
-# __db_engine = create_engine(config.SQLALCHEMY_DB, listeners=[ForeignKeysListener()], echo=config.SQLALCHEMY_ECHO)
+IN_MEMORY_DBS = ['sqlite://', 'sqlite:///:memory:']
+
+def create_db_engine(config):
+    """
+    Create the database engine for a config class, setting the SQLite pragmas
+    of the config on every new connection
+    """
+    options = {'echo': config.SQLALCHEMY_ECHO}
+
+    if config.SQLALCHEMY_DB in IN_MEMORY_DBS:
+        # NOTE: a single connection shared by all threads, otherwise each
+        # connection would get its own empty database
+        options.update(connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    elif config.SQLITE_FILE and not os.path.isdir(os.path.dirname(config.SQLITE_FILE)):
+        os.makedirs(os.path.dirname(config.SQLITE_FILE))
+
+    engine = create_engine(config.SQLALCHEMY_DB, **options)
+
+    # NOTE: the listener is necessary for SQLite to enforce foreign keys
+    pragmas = config.SQLITE_PRAGMAS
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_con, con_record):
+        cursor = dbapi_con.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {}={}'.format(name, value))
+        cursor.close()
+
+    return engine
+
+
+# NOTE: the scoped session works as a proxy to the session of the current thread
+DBSession = scoped_session(sessionmaker())
+db = DBSession
+_db_engine = None
+
+def db_configure(db_config):
+    """
+    (Re)create the database engine and session for the given config, and make
+    sure the tables exist
+    """
+    global _db_engine
+
+    DBSession.remove()
+    if _db_engine is not None:
+        _db_engine.dispose()
+
+    _db_engine = create_db_engine(db_config)
+    BaseModel.metadata.bind = _db_engine
+    DBSession.configure(bind=_db_engine)
+    db_init()
 
-BaseModel.metadata.bind = __db_engine
+def get_engine():
+    return _db_engine
 
 def db_init():
-    BaseModel.metadata.create_all(__db_engine)
+    BaseModel.metadata.create_all(_db_engine)
+    db_migrate()
+
+def db_migrate():
+    """
+    Bring the schema of an existing database up to date. New tables are
+    created by create_all, but the indexes added to existing tables are not
+    """
+    quote = _db_engine.dialect.identifier_preparer.quote
+    with _db_engine.begin() as connection:
+        for table in BaseModel.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute("CREATE {}INDEX IF NOT EXISTS {} ON {} ({})".format(
+                    'UNIQUE ' if index.unique else '', quote(index.name), quote(table.name),
+                    ', '.join(quote(column.name) for column in index.columns)))
 
 def db_reset(delete=False):
 
-    if delete and os.path.exists(config.SQLITE_FILE):
-        os.remove(config.SQLITE_FILE)
+    if delete and config.SQLITE_FILE and os.path.exists(config.SQLITE_FILE):
+        DBSession.remove()
+        _db_engine.dispose()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(config.SQLITE_FILE + suffix):
+                os.remove(config.SQLITE_FILE + suffix)
+        db_init()
 
     for table in reversed(BaseModel.metadata.sorted_tables):
         db.execute(table.delete())
     db.commit()
     db_init()
 
-DBSession = scoped_session(sessionmaker(bind=__db_engine))
-db = DBSession()
-db_init()
-
-
-
-
-
-
-
+# NOTE: the SQLite online backup API is only available from Python 3.7
+SQLITE_BACKUP_API = hasattr(sqlite3.Connection, 'backup')
 
+def db_backup(filepath):
+    """
+    Copy the current database into a standalone SQLite file, using the SQLite
+    backup API if available or a dump of the database otherwise. The file is
+    replaced atomically.
+    """
+    db.commit()
+    tmp_path = '{}.{}.tmp'.format(filepath, os.getpid())
+    if not os.path.isdir(os.path.dirname(filepath)):
+        os.makedirs(os.path.dirname(filepath))
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    connection = _db_engine.raw_connection()
+    try:
+        target = sqlite3.connect(tmp_path)
+        try:
+            if SQLITE_BACKUP_API:
+                connection.connection.backup(target)
+                # NOTE: the header of a WAL database is copied too
+                target.execute('PRAGMA journal_mode=DELETE')
+            else:
+                target.executescript('\n'.join(connection.connection.iterdump()))
+        finally:
+            target.close()
+    finally:
+        connection.close()
+
+    os.replace(tmp_path, filepath)
+
+def db_restore(filepath):
+    """
+    Replace the contents of the current database with a SQLite file
+    created by db_backup
+    """
+    DBSession.remove()
+
+    connection = _db_engine.raw_connection()
+    try:
+        if SQLITE_BACKUP_API:
+            source = sqlite3.connect('file:{}?mode=ro'.format(filepath), uri=True)
+            try:
+                source.backup(connection.connection)
+            finally:
+                source.close()
+        else:
+            copy_tables(connection.connection, filepath)
+    finally:
+        connection.close()
 
+    db_init()
 
+def copy_tables(dbapi_con, filepath):
+    """
+    Replace the rows of the tables of the models with the ones of another
+    SQLite file with the same schema, in a single transaction
+    """
+    tables = BaseModel.metadata.sorted_tables
+    quote = _db_engine.dialect.identifier_preparer.quote
+
+    dbapi_con.execute('ATTACH DATABASE ? AS snapshot', (filepath, ))
+    try:
+        for table in reversed(tables):
+            dbapi_con.execute('DELETE FROM main.{}'.format(quote(table.name)))
+        for table in tables:
+            columns = ', '.join(quote(column.name) for column in table.columns)
+            dbapi_con.execute('INSERT INTO main.{table} ({columns}) SELECT {columns} FROM snapshot.{table}'.format(
+                table=quote(table.name), columns=columns))
+        dbapi_con.commit()
+    except Exception:
+        dbapi_con.rollback()
+        raise
+    finally:
+        dbapi_con.execute('DETACH DATABASE snapshot')
+
+db_configure(config)
@@ -0,0 +1,67 @@
+"""
+Pool of processes for the per plate tasks (processing results, rendering
+templates)
+"""
+import logging
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+# Worker state, set when the processing pool starts
+worker_state = {}
+
+# NOTE: the workers are spawned instead of forked, so that they don't inherit
+# the state of the parent process, e.g. the GUI thread and log handlers or
+# the open database connections
+START_METHOD = 'spawn'
+
+
+def init_worker(state, log_level=None):
+    if log_level is not None:
+        setup_worker_logging(log_level)
+    worker_state.update(state)
+
+
+def setup_worker_logging(level):
+    """ Plain console logging for a worker process """
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('[%(levelname)s] %(asctime)s %(processName)s : %(message)s'))
+
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+class ProcessingPool(object):
+    """
+    Pool of processes for the per plate tasks, each worker with its own
+    copy of the worker state (e.g. proteins catalog, cache and options),
+    which must be picklable. With a single job the tasks run in the current
+    process.
+    """
+    def __init__(self, jobs, **state):
+        self.jobs = jobs
+        self.state = state
+        self.pool = None
+
+    def __enter__(self):
+        init_worker(self.state)
+        if self.jobs > 1:
+            logger.info("Processing plates with {} parallel jobs".format(self.jobs))
+            context = multiprocessing.get_context(START_METHOD)
+            self.pool = context.Pool(self.jobs, initializer=init_worker,
+                                     initargs=(self.state, logging.getLogger().getEffectiveLevel()))
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+
+    def imap(self, func, iterable):
+        # NOTE: results come back in the same order as the tasks
+        if self.pool:
+            return self.pool.imap(func, iterable)
+        return map(func, iterable)
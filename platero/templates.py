@@ -1,12 +1,16 @@
-
+import datetime
+import numbers
+import os
+import posixpath
 import re
+import zipfile
 from collections import OrderedDict
+from xml.sax.saxutils import escape, unescape
 
-from openpyxl import load_workbook
-
-from .assets import STORAGE_PLATE_TEMPLATE, SCREEN_PLATE_TEMPLATE
+from .assets import xls_template
 from .platero import config
-from platero.model.models import Protein, PROTEIN_ID_REGEX
+from platero.model.models import Protein, ProteinRow, PROTEIN_ID_REGEX
+from platero.parsing.parsing import column_index, column_letter
 from platero.utils import timestamp
 from platero.wellplate import WellPlate96, BaitStoragePlate, NEG_CONTROL, POS_CONTROL
 
@@ -14,7 +18,149 @@ DELIMITER = ' / '
 DELIMITER_RE = re.compile('\s*/\s*')
 TEMPLATE_CELL_RE = re.compile("^\s*({protein_id})\s*/\s*\s*({protein_id})\s*$".format(protein_id=PROTEIN_ID_REGEX))
 
+WORKBOOK_PART = 'xl/workbook.xml'
+WORKBOOK_RELS_PART = 'xl/_rels/workbook.xml.rels'
+CONTENT_TYPES_PART = '[Content_Types].xml'
+STYLES_PART = 'xl/styles.xml'
+WORKSHEET_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+WORKSHEET_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet'
+
+SHEET_RE = re.compile(r'<sheet\s[^>]*?/>')
+RELATIONSHIP_RE = re.compile(r'<Relationship\s[^>]*?/>')
+DEFINED_NAME_RE = re.compile(r'<definedName\s([^>]*)>([^<]*)</definedName>')
+ROW_RE = re.compile(r'<row\s[^>]*?\br="(\d+)"[^>]*?(?:/>|>.*?</row>)', re.S)
+CELL_RE = re.compile(r'<c\s[^>]*?\br="([A-Z]+)(\d+)"[^>]*?(?:/>|>.*?</c>)', re.S)
+CELL_STYLE_RE = re.compile(r'\ss="(\d+)"')
+CELL_REF_RE = re.compile(r'^\$?([A-Z]+)\$?(\d+)$')
+CELL_XFS_RE = re.compile(r'<cellXfs\b[^>]*?(?:/>|>(.*?)</cellXfs>)', re.S)
+RANGE_AREA_RE = re.compile(r'^(.+)!(\$?[A-Z]+\$?\d+):(\$?[A-Z]+\$?\d+)$')
+CELL_REF_TEXT_RE = re.compile(r'(\$?)\b([A-Z]{1,3})(\$?)(\d+)\b')
+SHEET_REF_ATTRIBUTE_RE = re.compile(r'\b(ref|sqref|activeCell)="([^"]*)"')
+COL_RE = re.compile(r'<col\b([^>]*?)/>')
+# Last column of a sheet (XFD, 0-based)
+MAX_COLUMN = 16383
+
+# Built-in number formats of the dates and times (m/d/yyyy, h:mm:ss and m/d/yyyy h:mm)
+DATE_NUMBER_FORMATS = OrderedDict([('date', 14), ('time', 21), ('datetime', 22)])
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+
+INFO_SHEET_XML = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                  '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                  '<cols><col min="1" max="1" width="20" customWidth="1"/>'
+                  '<col min="2" max="2" width="40" customWidth="1"/></cols>'
+                  '<sheetData>{rows}</sheetData></worksheet>')
+
+# Plates per task of the processing pools writing templates, rendered into
+# the same range lists (see export_screen_plates)
+RENDER_BATCH_SIZE = 20
+
+# Templates parsed in this process, by file path
+_template_archives = {}
+
+
+def get_template_archive(filepath):
+    """ Parsed contents of a template file, read only once per process """
+    filepath = os.path.abspath(filepath)
+    if filepath not in _template_archives:
+        _template_archives[filepath] = TemplateArchive(filepath)
+
+    return _template_archives[filepath]
+
+
+class TemplateArchive(object):
+    """
+    Parts of an xlsx template, with the sheets and the cells of its named
+    ranges resolved. Treated as read-only: the workbooks are written by
+    patching copies of the parts (see TemplateWorkbook.save)
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with zipfile.ZipFile(filepath) as archive:
+            self.parts = OrderedDict((name, archive.read(name)) for name in archive.namelist())
+
+        targets = {}
+        for relationship in RELATIONSHIP_RE.findall(self.text(WORKBOOK_RELS_PART)):
+            target = xml_attribute(relationship, 'Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join('xl', target))
+            targets[xml_attribute(relationship, 'Id')] = target
+
+        workbook = self.text(WORKBOOK_PART)
+
+        # Part and relationship id of each sheet, in workbook order
+        self.sheets = OrderedDict()
+        for sheet in SHEET_RE.findall(workbook):
+            rel_id = xml_attribute(sheet, 'r:id')
+            self.sheets[xml_attribute(sheet, 'name')] = (targets[rel_id], rel_id)
+
+        # Cells of each named range, as a list of (sheet name, cell reference)
+        self.names = {}
+        for attributes, refers_to in DEFINED_NAME_RE.findall(workbook):
+            if 'localSheetId' in attributes:
+                continue
+            try:
+                self.names[xml_attribute(attributes, 'name')] = range_cells(unescape(refers_to, {'&apos;': "'"}))
+            except ValueError:
+                # e.g. #REF!
+                continue
+
+        self.date_styles = add_date_styles(self.parts)
+        self._sheet_segments = {}
+
+    def text(self, part):
+        return part_text(self.parts, part)
+
+    def named_range(self, range_name):
+        """ List of (sheet name, cell reference) of a named range """
+        try:
+            return self.names[range_name]
+        except KeyError:
+            raise KeyError("No named range '{}' in template {}".format(range_name, self.filepath))
+
+    def sheet_segments(self, sheet_name):
+        """
+        XML of a sheet split at the cells of the named ranges, as the list of
+        the text segments between them and the list of (reference, style,
+        original xml) of the cells
+        """
+        if sheet_name not in self._sheet_segments:
+            refs = set(ref for cells in self.names.values() for sheet, ref in cells if sheet == sheet_name)
+            xml = add_missing_cells(self.text(self.sheets[sheet_name][0]), refs)
+
+            segments, cells, position = [], [], 0
+            for match in CELL_RE.finditer(xml):
+                ref = match.group(1) + match.group(2)
+                if ref not in refs:
+                    continue
+                segments.append(xml[position:match.start()])
+                style = CELL_STYLE_RE.search(match.group(0).split('>', 1)[0])
+                cells.append((ref, style.group(1) if style else None, match.group(0)))
+                position = match.end()
+            segments.append(xml[position:])
+
+            self._sheet_segments[sheet_name] = (segments, cells)
+
+        return self._sheet_segments[sheet_name]
+
+    def patch_sheet(self, sheet_name, values):
+        """ XML of a sheet with the values of some of its named range cells """
+        segments, cells = self.sheet_segments(sheet_name)
+        xml = [segments[0]]
+        for (ref, style, original), segment in zip(cells, segments[1:]):
+            xml.append(cell_xml(ref, values[ref], style, self.date_styles) if ref in values else original)
+            xml.append(segment)
+
+        return ''.join(xml)
+
+
 class TemplateWorkbook(object):
+    """
+    Workbook generated from a template. The template file is parsed once per
+    process, and the values set are written on save by rewriting only the
+    affected sheets of a copy of the template.
+    """
     ws_info = 'Info'
 
     def __init__(self, template):
@@ -24,14 +170,17 @@ class TemplateWorkbook(object):
 
     def reload(self):
         """ Reload the workbook from the original source """
-        self.wb = load_workbook(self.source)
+        self.archive = get_template_archive(self.source)
+        self.sheet_names = list(self.archive.sheets)
+        self.values = {}
+        self.info = None
 
     def remove_sheet_by_name(self, sheet_name):
-        try:
-            ws = self.wb.get_sheet_by_name(sheet_name)
-            self.wb.remove_sheet(ws)
-        except KeyError:
-            pass
+        if sheet_name in self.sheet_names:
+            self.sheet_names.remove(sheet_name)
+            self.values.pop(sheet_name, None)
+            if sheet_name == self.ws_info:
+                self.info = None
 
     def set_info(self, metadata):
         """
@@ -39,8 +188,8 @@ class TemplateWorkbook(object):
         sheet is cleared before adding the metadata. Some additional
         info is also added.
         """
-        self.remove_sheet_by_name(self.ws_info)
-        ws = self.wb.create_sheet(title=self.ws_info)
+        if self.ws_info not in self.sheet_names:
+            self.sheet_names.append(self.ws_info)
 
         # TODO: move to save()
         info = OrderedDict({
@@ -49,106 +198,546 @@ class TemplateWorkbook(object):
         })
         metadata.update(info)
 
-        for row, key in enumerate(metadata):
-            ws.cell(row=row + 1, column=1).value = key
-            ws.cell(row=row + 1, column=2).value = metadata[key]
-
-        # Adjust column width for readability
-        ws.column_dimensions['A'].width = 20
-        ws.column_dimensions['B'].width = 40
+        self.info = list(metadata.items())
 
     def set_cell_range(self, sheet_name, range_name, values):
         """
         Set the values of an range of cells from a given list of values
         """
-        ws = self.wb.get_sheet_by_name(sheet_name)
-        cells = ws.get_named_range(range_name)
+        if sheet_name not in self.sheet_names:
+            raise KeyError("Worksheet {} does not exist.".format(sheet_name))
 
+        cells = self.archive.named_range(range_name)
         if len(cells) != len(values):
             raise AttributeError("The number of values ({}) doesn't match the " \
                 "size of the cell range ({})".format(len(values), len(cells)))
 
-        for cell, value in zip(cells, values):
-            cell.value = value
+        sheet_values = self.values.setdefault(sheet_name, {})
+        for (sheet, ref), value in zip(cells, values):
+            if sheet != sheet_name:
+                raise KeyError("Range {} is not in worksheet {}".format(range_name, sheet_name))
+            sheet_values[ref] = value
 
     def save(self, destination):
         """ Save the workbook to the specified destination """
-        self.wb.save(destination)
+        parts = OrderedDict(self.archive.parts)
+
+        for sheet_name, values in self.values.items():
+            parts[self.archive.sheets[sheet_name][0]] = self.archive.patch_sheet(sheet_name, values)
+
+        for sheet_name in self.archive.sheets:
+            if sheet_name not in self.sheet_names:
+                remove_sheet(parts, sheet_name, *self.archive.sheets[sheet_name])
+
+        if self.info is not None:
+            rows = [row_xml(row + 1, [key, value], self.archive.date_styles) for row, (key, value) in enumerate(self.info)]
+            if self.ws_info in self.archive.sheets:
+                part = self.archive.sheets[self.ws_info][0]
+            else:
+                part = add_sheet(parts, self.ws_info)
+            parts[part] = INFO_SHEET_XML.format(rows=''.join(rows))
+
+        with zipfile.ZipFile(destination, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, content in parts.items():
+                archive.writestr(name, content)
+
+
+def xml_attribute(element, name):
+    """ Value of an attribute of an xml element (as text) """
+    match = re.search(r'(?:^|\s){}="([^"]*)"'.format(re.escape(name)), element)
+    return unescape(match.group(1), {'&quot;': '"', '&apos;': "'"}) if match else None
+
+
+def range_cells(refers_to):
+    """
+    List of (sheet name, cell reference) of a range formula, e.g.
+    Pipetting!$A$1,Pipetting!$B$5:$M$12. The cells of each area are listed
+    row by row. Raises ValueError if the formula is not a list of areas.
+    """
+    cells = []
+    sheet = None
+    for area in refers_to.split(','):
+        if '!' in area:
+            sheet, area = area.rsplit('!', 1)
+            sheet = sheet.strip("'").replace("''", "'")
+        if sheet is None:
+            raise ValueError("Range without a worksheet: {}".format(refers_to))
 
-# TODO: refactor these functions cleaner, so ugly!
-def display_protein(protein, property):
-    if type(protein)==Protein:
-        return getattr(protein, property)
-    return ''
-
-def display_interaction(interaction, property):
+        try:
+            (first_column, first_row), (last_column, last_row) = [
+                CELL_REF_RE.match(ref).groups() for ref in (area.split(':') * 2)[:2]]
+        except AttributeError:
+            raise ValueError("Invalid range: {}".format(refers_to))
+
+        for row in range(int(first_row), int(last_row) + 1):
+            for column in range(column_index(first_column), column_index(last_column) + 1):
+                cells.append((sheet, '{}{}'.format(column_letter(column), row)))
+
+    return cells
+
+
+def cell_xml(ref, value, style=None, date_styles=None):
+    """
+    Cell element of a sheet, with strings written inline. Dates and times are
+    written as numbers with the style of their kind (see add_date_styles)
+    """
+    if isinstance(value, (datetime.date, datetime.time)):
+        kind = date_kind(value)
+        value = excel_serial(value)
+        style = (date_styles or {}).get(kind, style)
 
-    if type(interaction)==dict:
-        if interaction['prey'] in [POS_CONTROL, NEG_CONTROL, '', None]:
-            return interaction['prey']
+    attributes = 'r="{}"'.format(ref)
+    if style:
+        attributes += ' s="{}"'.format(style)
+
+    if value is None or value == '' or value != value:
+        return '<c {}/>'.format(attributes)
+    if isinstance(value, bool):
+        return '<c {} t="b"><v>{}</v></c>'.format(attributes, int(value))
+    if isinstance(value, numbers.Number):
+        return '<c {}><v>{}</v></c>'.format(attributes, value)
+
+    return '<c {} t="inlineStr"><is><t xml:space="preserve">{}</t></is></c>'.format(attributes, escape(str(value)))
+
+
+def date_kind(value):
+    """ Kind of a date or time value: 'datetime', 'date' or 'time' """
+    if isinstance(value, datetime.datetime):
+        return 'datetime'
+    return 'date' if isinstance(value, datetime.date) else 'time'
+
+
+def excel_serial(value):
+    """ Excel serial number of a date or time: days since 1899-12-30, times as fractions of a day """
+    if isinstance(value, datetime.time):
+        return (value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6) / 86400
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+
+    delta = value.replace(tzinfo=None) - EXCEL_EPOCH
+    return delta.days + (delta.seconds + delta.microseconds / 1e6) / 86400
+
+
+def add_date_styles(parts):
+    """
+    Add a cell style for each kind of date value (see DATE_NUMBER_FORMATS) to
+    the styles of a workbook, returning the style index of each kind
+    """
+    if STYLES_PART not in parts:
+        return {}
+
+    styles = part_text(parts, STYLES_PART)
+    match = CELL_XFS_RE.search(styles)
+    if match is None:
+        return {}
+
+    xfs = match.group(1) or ''
+    first = len(re.findall(r'<xf\b', xfs))
+    date_xfs = ''.join('<xf numFmtId="{}" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'.format(
+        number_format) for number_format in DATE_NUMBER_FORMATS.values())
+    cell_xfs = '<cellXfs count="{}">{}{}</cellXfs>'.format(first + len(DATE_NUMBER_FORMATS), xfs, date_xfs)
+    parts[STYLES_PART] = (styles[:match.start()] + cell_xfs + styles[match.end():]).encode('utf-8')
+
+    return {kind: first + i for i, kind in enumerate(DATE_NUMBER_FORMATS)}
+
+
+def row_xml(row, values, date_styles=None):
+    """ Row element of a sheet, for the values of its first columns """
+    cells = [cell_xml('{}{}'.format(column_letter(column), row), value, date_styles=date_styles)
+             for column, value in enumerate(values)]
+    return '<row r="{}">{}</row>'.format(row, ''.join(cells))
+
+
+def add_missing_cells(sheet_xml, refs):
+    """ Add the empty cells (and rows) missing from the xml of a sheet """
+    sheet_xml = sheet_xml.replace('<sheetData/>', '<sheetData></sheetData>')
+
+    for ref in sorted(refs):
+        column, row = CELL_REF_RE.match(ref).groups()
+        rows = list(ROW_RE.finditer(sheet_xml))
+        row_match = next((match for match in rows if match.group(1) == row), None)
+
+        if row_match is None:
+            after = [match.start() for match in rows if int(match.group(1)) > int(row)]
+            position = after[0] if after else sheet_xml.index('</sheetData>')
+            sheet_xml = '{}<row r="{}"><c r="{}"/></row>{}'.format(sheet_xml[:position], row, ref, sheet_xml[position:])
+            continue
+
+        element = row_match.group(0)
+        cells = list(CELL_RE.finditer(element))
+        if any(match.group(1) == column for match in cells):
+            continue
 
-        return '{bait}{delimiter}{prey}'.format(
-            bait = display_protein(interaction['bait'], property),
-            prey = display_protein(interaction['prey'], property),
-            delimiter = DELIMITER
-        )
-    return ''
+        if not cells and element.endswith('/>'):
+            element = '{}><c r="{}"/></row>'.format(element[:-2], ref)
+        else:
+            after = [match.start() for match in cells if column_index(match.group(1)) > column_index(column)]
+            position = after[0] if after else element.rindex('</row>')
+            element = '{}<c r="{}"/>{}'.format(element[:position], ref, element[position:])
+        sheet_xml = sheet_xml[:row_match.start()] + element + sheet_xml[row_match.end():]
+
+    return sheet_xml
+
+
+def part_text(parts, name):
+    """ Contents of a workbook part, as text """
+    content = parts[name]
+    return content.decode('utf-8') if isinstance(content, bytes) else content
 
-def export_screen_plate(filename, plate, metadata):
-    ws_template = 'Template'
-    rng_template_proteins = 'rng_template_proteins'
-    rng_template_nicknames = 'rng_template_nicknames'
-    rng_template_labels = 'rng_template_labels'
 
-    ws_pipetting = 'Pipetting'
-    rng_pipetting_labels = 'rng_pipetting_labels'
-    rng_pipetting_prey = 'rng_pipetting_prey'
-    rng_pipetting_bait = 'rng_pipetting_bait'
+def remove_sheet(parts, sheet_name, part, rel_id):
+    """ Remove a sheet, and the names referring to it, from the parts of a workbook """
+    workbook = part_text(parts, WORKBOOK_PART)
+    sheets = SHEET_RE.findall(workbook)
+    index = [xml_attribute(sheet, 'name') for sheet in sheets].index(sheet_name)
+    workbook = workbook.replace(sheets[index], '')
 
-    wb = TemplateWorkbook(SCREEN_PLATE_TEMPLATE)
+    for match in DEFINED_NAME_RE.finditer(workbook):
+        try:
+            cells = range_cells(unescape(match.group(2), {'&apos;': "'"}))
+        except ValueError:
+            continue
+        if any(sheet == sheet_name for sheet, ref in cells):
+            workbook = workbook.replace(match.group(0), '')
+    workbook = workbook.replace('<definedNames></definedNames>', '')
+
+    # Keep the active sheet within the remaining ones
+    active_tab = re.search(r'activeTab="(\d+)"', workbook)
+    if active_tab:
+        active = int(active_tab.group(1))
+        if active > index or active == len(sheets) - 1:
+            active = max(active - 1, 0)
+        workbook = workbook.replace(active_tab.group(0), 'activeTab="{}"'.format(active))
+    parts[WORKBOOK_PART] = workbook
+
+    rels = part_text(parts, WORKBOOK_RELS_PART)
+    for relationship in RELATIONSHIP_RE.findall(rels):
+        if xml_attribute(relationship, 'Id') == rel_id:
+            rels = rels.replace(relationship, '')
+    parts[WORKBOOK_RELS_PART] = rels
+
+    content_types = part_text(parts, CONTENT_TYPES_PART)
+    parts[CONTENT_TYPES_PART] = re.sub(r'<Override\s[^>]*?PartName="/{}"[^>]*?/>'.format(re.escape(part)), '', content_types)
+
+    del parts[part]
+    parts.pop(posixpath.join(posixpath.dirname(part), '_rels', posixpath.basename(part) + '.rels'), None)
+
+
+def add_sheet(parts, sheet_name):
+    """ Add an empty sheet at the end of a workbook, returning the name of its part """
+    workbook = part_text(parts, WORKBOOK_PART)
+    rels = part_text(parts, WORKBOOK_RELS_PART)
+
+    number = 1
+    while 'xl/worksheets/sheet{}.xml'.format(number) in parts:
+        number += 1
+    part = 'xl/worksheets/sheet{}.xml'.format(number)
+
+    rel_ids = [xml_attribute(relationship, 'Id') for relationship in RELATIONSHIP_RE.findall(rels)]
+    rel_id = 'rId{}'.format(max([int(x[3:]) for x in rel_ids if x[3:].isdigit()] + [0]) + 1)
+    sheet_ids = [int(xml_attribute(sheet, 'sheetId')) for sheet in SHEET_RE.findall(workbook)]
+
+    parts[WORKBOOK_PART] = workbook.replace('</sheets>', '<sheet name="{}" sheetId="{}" r:id="{}"/></sheets>'.format(
+        escape(sheet_name, {'"': '&quot;'}), max(sheet_ids + [0]) + 1, rel_id))
+    parts[WORKBOOK_RELS_PART] = rels.replace('</Relationships>', '<Relationship Id="{}" Type="{}" Target="{}"/></Relationships>'.format(
+        rel_id, WORKSHEET_REL_TYPE, posixpath.relpath(part, 'xl')))
+    parts[CONTENT_TYPES_PART] = part_text(parts, CONTENT_TYPES_PART).replace('</Types>', '<Override PartName="/{}" ContentType="{}"/></Types>'.format(
+        part, WORKSHEET_CONTENT_TYPE))
+
+    return part
+
+
+def scale_template(source, destination, geometry):
+    """
+    Write a template for the plates of a geometry from the template of
+    another plate size (i.e. the 96 well one). The cells of the well ranges
+    are resized to the rows and columns of the geometry, along with their row
+    labels and column numbers. The 384 and 1536 well templates are generated
+    this way.
+    """
+    with zipfile.ZipFile(source) as archive:
+        parts = OrderedDict((name, archive.read(name)) for name in archive.namelist())
+    workbook = part_text(parts, WORKBOOK_PART)
+
+    # Areas of the well ranges of each sheet, as (top, bottom, left, right)
+    blocks = {}
+    for attributes, refers_to in DEFINED_NAME_RE.findall(workbook):
+        area = RANGE_AREA_RE.match(unescape(refers_to, {'&apos;': "'"}))
+        if area:
+            sheet, first, last = area.groups()
+            (top, left), (bottom, right) = cell_position(first), cell_position(last)
+            blocks.setdefault(sheet.strip("'").replace("''", "'"), set()).add((top, bottom, left, right))
+
+    shapes = set((bottom - top + 1, right - left + 1) for areas in blocks.values() for top, bottom, left, right in areas)
+    if len(shapes) != 1:
+        raise ValueError("The well ranges of template {} don't have the same size".format(source))
+    shape = shapes.pop()
+
+    scales = {sheet: SheetScale(sorted(areas), shape, geometry) for sheet, areas in blocks.items()}
+    sheets = TemplateArchive(source).sheets
+    for sheet_name, scale in scales.items():
+        part = sheets[sheet_name][0]
+        parts[part] = scale.sheet(part_text(parts, part))
+
+    def scale_name(match):
+        areas = []
+        for area in unescape(match.group(2), {'&apos;': "'"}).split(','):
+            sheet, refs = area.rsplit('!', 1) if '!' in area else ('', area)
+            scale = scales.get(sheet.strip("'").replace("''", "'"))
+            areas.append('{}!{}'.format(sheet, scale.refs(refs)) if scale else area)
+        return '<definedName {}>{}</definedName>'.format(match.group(1), escape(','.join(areas), {"'": '&apos;'}))
+
+    parts[WORKBOOK_PART] = DEFINED_NAME_RE.sub(scale_name, workbook)
+
+    with zipfile.ZipFile(destination, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in parts.items():
+            # NOTE: fixed timestamps, so that the same template is generated every time
+            archive.writestr(zipfile.ZipInfo(name, (1980, 1, 1, 0, 0, 0)), content, zipfile.ZIP_DEFLATED)
+
+
+def cell_position(ref):
+    """ Row number and 0-based column index of a cell reference (e.g. $B$5 -> (5, 1)) """
+    column, row = CELL_REF_RE.match(ref).groups()
+    return int(row), column_index(column)
+
+
+class SheetScale(object):
+    """
+    Positions of the cells of a template sheet once its well ranges, blocks
+    of cells of the same columns, are resized to a plate geometry. The rows
+    and columns after each block are shifted (see scale_template)
+    """
+    def __init__(self, blocks, shape, geometry):
+        self.blocks = blocks
+        self.rows, self.columns = shape
+        self.geometry = geometry
+        self.extra_rows = geometry.shape[0] - self.rows
+        self.extra_columns = geometry.shape[1] - self.columns
+
+        if len(set(block[2:] for block in blocks)) != 1:
+            raise ValueError("The well ranges of a sheet must have the same columns")
+        self.left, self.right = blocks[0][2:]
+
+    def row(self, row):
+        return row + self.extra_rows * sum(1 for top, bottom, left, right in self.blocks if bottom <= row)
+
+    def column(self, column):
+        """ Position of a column, by 0-based index """
+        if self.right <= column < MAX_COLUMN:
+            return column + self.extra_columns
+        return column
+
+    def refs(self, text):
+        """ Text with its cell references moved """
+        return CELL_REF_TEXT_RE.sub(lambda match: '{}{}{}{}'.format(
+            match.group(1), column_letter(self.column(column_index(match.group(2)))),
+            match.group(3), self.row(int(match.group(4)))), text)
+
+    def sheet(self, sheet_xml):
+        """ XML of the sheet with the blocks resized """
+        start, end = sheet_xml.index('<sheetData'), sheet_xml.find('</sheetData>')
+        if end < 0:
+            return sheet_xml
+
+        elements = OrderedDict((int(match.group(1)), match.group(0)) for match in ROW_RE.finditer(sheet_xml, start, end))
+        tops = set(block[0] for block in self.blocks)
+
+        rows = []
+        for row, element in elements.items():
+            block = next((block for block in self.blocks if block[0] <= row <= block[1]), None)
+            if block is None:
+                rows.append(self.row_xml(element, self.row(row), header=row + 1 in tops))
+            elif row == block[0]:
+                # NOTE: the rows of the block are repeated, e.g. for their alternate styles
+                for i, label in enumerate(self.geometry.rows):
+                    if row + i % self.rows in elements:
+                        rows.append(self.row_xml(elements[row + i % self.rows], self.row(row) + i, label=label))
+
+        head = SHEET_REF_ATTRIBUTE_RE.sub(self.ref_attribute, sheet_xml[:start])
+        head = COL_RE.sub(lambda match: match.group(0).replace(match.group(1), self.col_attributes(match.group(1))), head)
+        sheet_data = sheet_xml[start:sheet_xml.index('>', start) + 1]
+        tail = SHEET_REF_ATTRIBUTE_RE.sub(self.ref_attribute, sheet_xml[end:])
+
+        return head + sheet_data + ''.join(rows) + tail
+
+    def ref_attribute(self, match):
+        return '{}="{}"'.format(match.group(1), self.refs(match.group(2)))
+
+    def col_attributes(self, attributes):
+        """ Attributes of a column definition, with the 1-based min and max columns moved """
+        return re.sub(r'\b(min|max)="(\d+)"', lambda match: '{}="{}"'.format(
+            match.group(1), self.column(int(match.group(2)) - 1) + 1), attributes)
+
+    def row_xml(self, element, row, label=None, header=False):
+        """
+        Row element moved to a row number, with the cells of the block
+        repeated for the columns of the geometry. The cell before the block
+        is set to the label, if any, and in header rows the cells of the
+        block are set to the column numbers.
+        """
+        tag = re.match(r'<row\b[^>]*?/?>', element).group(0)
+        tag = re.sub(r'\sspans="[^"]*"', '', re.sub(r'\br="\d+"', 'r="{}"'.format(row), tag, count=1))
+        if tag.endswith('/>'):
+            return tag
 
-    # Template sheet
-    plate_label = 'Plate: {}'.format(plate.name)
-    wb.set_cell_range(ws_template, rng_template_labels, [plate_label])
+        cells = OrderedDict((column_index(match.group(1)), match.group(0)) for match in CELL_RE.finditer(element))
+        scaled, block_done = [], False
+        for column, cell in cells.items():
+            if column == self.left - 1 and label is not None:
+                scaled.append(cell_xml(cell_ref(column, row), label, cell_style(cell)))
+            elif column < self.left or column > self.right:
+                scaled.append(move_cell(cell, cell_ref(self.column(column), row)))
+            elif not block_done:
+                block_done = True
+                for j in range(len(self.geometry.columns)):
+                    source = cells.get(self.left + j % self.columns)
+                    if source is None:
+                        continue
+                    ref = cell_ref(self.left + j, row)
+                    scaled.append(cell_xml(ref, j + 1, cell_style(source)) if header else move_cell(source, ref))
 
-    proteins = [display_interaction(interaction, 'id') for cell, interaction in plate.values.items()]
-    wb.set_cell_range(ws_template, rng_template_proteins, proteins)
+        return '{}{}</row>'.format(tag, ''.join(scaled))
 
-    nicknames = [display_interaction(interaction, 'nickname') for cell, interaction in plate.values.items()]
-    wb.set_cell_range(ws_template, rng_template_nicknames, nicknames)
 
-    # Pipetting sheet
-    bait_label = 'Bait plate: {}'.format(plate.bait_plate_name)
-    prey_label = 'Prey plate: {}'.format(plate.prey_plate_name)
-    pipetting_labels = [plate_label, bait_label, prey_label]
-    wb.set_cell_range(ws_pipetting, rng_pipetting_labels, pipetting_labels)
+def cell_ref(column, row):
+    return '{}{}'.format(column_letter(column), row)
 
-    preys = [display_protein(interaction['prey'], 'nickname') for cell, interaction in plate.values.items()]
-    wb.set_cell_range(ws_pipetting, rng_pipetting_prey, preys)
 
-    baits = [display_protein(bait, 'nickname') for cell, bait in plate.bait_plate.values.items()]
-    wb.set_cell_range(ws_pipetting, rng_pipetting_bait, baits)
+def cell_style(element):
+    """ Style index of a cell element, None if not set """
+    style = CELL_STYLE_RE.search(element.split('>', 1)[0])
+    return style.group(1) if style else None
 
-    wb.set_info(metadata)
-    wb.save(filename)
 
-def export_storage_plate(filename, plate, metadata):
-    ws_proteins = 'Proteins'
-    rng_labels = 'rng_labels'
-    rng_proteins = 'rng_proteins'
-    rng_nicknames  = 'rng_nicknames'
+def move_cell(element, ref):
+    """ Cell element with a new reference """
+    return re.sub(r'\br="[A-Z]+\d+"', 'r="{}"'.format(ref), element, count=1)
 
-    wb = TemplateWorkbook(STORAGE_PLATE_TEMPLATE)
 
-    # Proteins sheet
-    plate_label = 'Plate: {}'.format(plate.name)
-    wb.set_cell_range(ws_proteins, rng_labels, [plate_label])
+# TODO: refactor these functions cleaner, so ugly!
+def display_protein(protein, property):
+    if isinstance(protein, (Protein, ProteinRow)):
+        return getattr(protein, property)
+    return ''
 
-    proteins = [display_protein(protein, 'id') for cell, protein in plate.values.items()]
-    wb.set_cell_range(ws_proteins, rng_proteins, proteins)
+def item_labels(items, property):
+    """ Display value of each item of a plate (by code), as display_protein """
+    return [display_protein(item, property) for item in items]
+
+# Template sheets and named ranges of each kind of plate
+SCREEN_RANGES = [
+    ('Template', 'rng_template_labels'),
+    ('Template', 'rng_template_proteins'),
+    ('Template', 'rng_template_nicknames'),
+    ('Pipetting', 'rng_pipetting_labels'),
+    ('Pipetting', 'rng_pipetting_prey'),
+    ('Pipetting', 'rng_pipetting_bait'),
+]
+STORAGE_RANGES = [
+    ('Proteins', 'rng_labels'),
+    ('Proteins', 'rng_proteins'),
+    ('Proteins', 'rng_nicknames'),
+]
+
+def allocate_ranges(ranges, well_ranges, size):
+    """
+    Lists for the values of the well ranges of a template, reusing the ones
+    given (e.g. from the previous plate of a batch) if they have the size
+    """
+    if ranges is None or any(len(ranges.get(name, ())) != size for name in well_ranges):
+        ranges = {name: [None] * size for name in well_ranges}
+
+    return ranges
+
+def render_screen_plate(plate, ranges=None):
+    """
+    Values of the named ranges of the template of a screen plate, rendered
+    in a single pass over the codes of its wells. The values are written to
+    the given lists, if any (see allocate_ranges)
+    """
+    ranges = allocate_ranges(ranges, ['rng_template_proteins', 'rng_template_nicknames',
+                                      'rng_pipetting_prey', 'rng_pipetting_bait'], plate.geometry.size)
 
-    nicknames = [display_protein(protein, 'nickname')for cell, protein in plate.values.items()]
-    wb.set_cell_range(ws_proteins, rng_nicknames, nicknames)
+    plate_label = 'Plate: {}'.format(plate.name)
+    ranges['rng_template_labels'] = [plate_label]
+    ranges['rng_pipetting_labels'] = [plate_label,
+                                      'Bait plate: {}'.format(plate.bait_plate_name),
+                                      'Prey plate: {}'.format(plate.prey_plate_name)]
+
+    # Values of each item, by code
+    bait_items, prey_items = plate.bait_wells.items, plate.prey_wells.items
+    bait_ids, bait_nicknames = item_labels(bait_items, 'id'), item_labels(bait_items, 'nickname')
+    prey_ids, prey_nicknames = item_labels(prey_items, 'id'), item_labels(prey_items, 'nickname')
+    # NOTE: controls and empty wells show the prey value instead of the pair
+    is_label = [prey in [POS_CONTROL, NEG_CONTROL, '', None] for prey in prey_items]
+
+    proteins, nicknames = ranges['rng_template_proteins'], ranges['rng_template_nicknames']
+    preys = ranges['rng_pipetting_prey']
+    wells = zip(plate.bait_wells.codes.ravel().tolist(), plate.prey_wells.codes.ravel().tolist())
+    for well, (bait, prey) in enumerate(wells):
+        if is_label[prey]:
+            proteins[well] = nicknames[well] = prey_items[prey]
+        else:
+            proteins[well] = '{}{}{}'.format(bait_ids[bait], DELIMITER, prey_ids[prey])
+            nicknames[well] = '{}{}{}'.format(bait_nicknames[bait], DELIMITER, prey_nicknames[prey])
+        preys[well] = prey_nicknames[prey]
+
+    # Bait storage wells to pipette from
+    baits = ranges['rng_pipetting_bait']
+    bait_plate_nicknames = item_labels(plate.bait_plate.items, 'nickname')
+    for well, code in enumerate(plate.bait_plate.codes.ravel().tolist()):
+        baits[well] = bait_plate_nicknames[code]
+
+    return ranges
+
+def render_storage_plate(plate, ranges=None):
+    """ Same as render_screen_plate, for the template of a storage plate """
+    ranges = allocate_ranges(ranges, ['rng_proteins', 'rng_nicknames'], plate.geometry.size)
+    ranges['rng_labels'] = ['Plate: {}'.format(plate.name)]
+
+    ids, nicknames = item_labels(plate.items, 'id'), item_labels(plate.items, 'nickname')
+    proteins, protein_nicknames = ranges['rng_proteins'], ranges['rng_nicknames']
+    for well, code in enumerate(plate.codes.ravel().tolist()):
+        proteins[well] = ids[code]
+        protein_nicknames[well] = nicknames[code]
+
+    return ranges
+
+def export_plate(filename, template, template_ranges, ranges, metadata):
+    """ Write the rendered ranges of a plate and its metadata to a template """
+    wb = TemplateWorkbook(template)
+    for sheet_name, range_name in template_ranges:
+        wb.set_cell_range(sheet_name, range_name, ranges[range_name])
 
     wb.set_info(metadata)
     wb.save(filename)
+
+def export_screen_plate(filename, plate, metadata, ranges=None):
+    """ Write the template of a screen plate, returning its rendered ranges """
+    ranges = render_screen_plate(plate, ranges)
+    export_plate(filename, xls_template('screen', plate.geometry.size), SCREEN_RANGES, ranges, metadata)
+    return ranges
+
+def export_storage_plate(filename, plate, metadata, ranges=None):
+    """ Write the template of a storage plate, returning its rendered ranges """
+    ranges = render_storage_plate(plate, ranges)
+    export_plate(filename, xls_template('storage', plate.geometry.size), STORAGE_RANGES, ranges, metadata)
+    return ranges
+
+def export_screen_plates(exports):
+    """
+    Batch mode of export_screen_plate, for (filename, plate, metadata)
+    items: every plate is rendered into the same lists. Yields the filename
+    of each template once written
+    """
+    ranges = None
+    for filename, plate, metadata in exports:
+        ranges = export_screen_plate(filename, plate, metadata, ranges)
+        yield filename
+
+def export_storage_plates(exports):
+    """ Batch mode of export_storage_plate, same as export_screen_plates """
+    ranges = None
+    for filename, plate, metadata in exports:
+        ranges = export_storage_plate(filename, plate, metadata, ranges)
+        yield filename
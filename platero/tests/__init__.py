@@ -0,0 +1,4 @@
+import os
+
+# NOTE: must be set before platero.platero is imported
+os.environ.setdefault('PLATERO_CONFIG', 'test')
@@ -0,0 +1,70 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from platero.parsing import cache as reads_cache
+from platero.parsing.cache import ReadsCache
+
+BLOCK = (['Time', 'T Lum', 'A1', 'A2'], np.array([0, 60]), np.array([[25.0, 10.5, np.nan], [25.0, 11.0, 12.0]]))
+METADATA = OrderedDict([('Reader', 'Synergy'), ('Read', 'Lum')])
+
+
+@pytest.fixture
+def parsed_files(monkeypatch):
+    """ Plate reader files parsed without the cache """
+    parsed = []
+    def parse_plate_block(filepath):
+        parsed.append(os.path.basename(filepath))
+        return BLOCK, METADATA
+
+    monkeypatch.setattr(reads_cache, 'parse_plate_block', parse_plate_block)
+    return parsed
+
+def results_file(tmpdir, name):
+    path = tmpdir.join(name)
+    path.write(name)
+    return str(path)
+
+
+def test_reads_cache(tmpdir, parsed_files):
+    cache = ReadsCache(str(tmpdir.join('cache')), 2**20)
+    filepath = results_file(tmpdir, 'plate_00001_results.xls')
+
+    reads, metadata = cache.parse_plate_results(filepath)
+    cached_reads, cached_metadata = cache.parse_plate_results(filepath)
+
+    assert parsed_files == ['plate_00001_results.xls']
+    assert cached_reads.equals(reads)
+    assert list(cached_reads.columns) == ['Time', 'T Lum', 'A1', 'A2']
+    assert cached_metadata == metadata == METADATA
+
+    # Files with other contents are parsed again
+    cache.parse_plate_results(results_file(tmpdir, 'plate_00002_results.xls'))
+    assert parsed_files == ['plate_00001_results.xls', 'plate_00002_results.xls']
+
+def test_reads_cache_parser_version(tmpdir, parsed_files, monkeypatch):
+    cache = ReadsCache(str(tmpdir.join('cache')), 2**20)
+    filepath = results_file(tmpdir, 'plate_00001_results.xls')
+    cache.parse_plate_results(filepath)
+
+    monkeypatch.setattr(reads_cache, 'PARSER_VERSION', reads_cache.PARSER_VERSION + 1)
+    cache.parse_plate_results(filepath)
+    cache.parse_plate_results(filepath)
+
+    assert parsed_files == ['plate_00001_results.xls'] * 2
+
+def test_reads_cache_eviction(tmpdir):
+    cache = ReadsCache(str(tmpdir.join('cache')), 2**20)
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.save(key, BLOCK, METADATA)
+        os.utime(cache.entry_path(key), (i, i))
+
+    # The least recently used entry is evicted, reading an entry counts as a use
+    assert cache.load('a') is not None
+    cache.max_size = 3 * os.path.getsize(cache.entry_path('a'))
+    cache.save('d', BLOCK, METADATA)
+
+    assert sorted(os.listdir(cache.folder)) == ['a.npz', 'c.npz', 'd.npz']
+    assert cache.load('b') is None
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from platero.export import Crosstab, crosstab_rows, threshold_values
+
+
+def screen_table():
+    """ Screen table with repeated interactions, missing values and keys, and a bait without values """
+    rows = [
+        # PreyFamily, PreySubfamily, Prey, BaitFamily, BaitSubfamily, Bait, Normalized, Z_Score
+        ['F1', 'S1', 'P1', 'F1', 'S1', 'B1', 1.0, 5.0],
+        ['F1', 'S1', 'P1', 'F1', 'S1', 'B1', 3.0, 7.0],
+        ['F1', 'S1', 'P2', 'F1', 'S1', 'B1', 2.0, 3.0],
+        ['F2', 'S2', 'P3', 'F1', 'S1', 'B1', np.nan, 8.0],
+        ['F1', 'S1', 'P1', 'F2', 'S2', 'B2', 4.0, 6.0],
+        ['F2', 'S2', 'P3', 'F2', 'S2', 'B2', 5.0, np.nan],
+        ['F1', 'S1', 'P2', 'F2', 'S3', 'B3', np.nan, 1.0],
+        ['F2', 'S2', 'P3', 'F2', 'S3', 'B3', np.nan, 2.0],
+        [np.nan, 'S1', 'P4', 'F1', 'S1', 'B1', 6.0, 9.0],
+        ['F1', 'S1', 'P1', 'F1', np.nan, 'B4', 7.0, 9.0],
+    ]
+    return pd.DataFrame(rows, columns=Crosstab.index_columns + Crosstab.header_columns + ['Normalized', 'Z_Score'])
+
+def pivot(df, values):
+    """ Crosstab as built before the shared layout """
+    return pd.pivot_table(df.assign(Normalized=values), values='Normalized',
+                          index=Crosstab.index_columns, columns=Crosstab.header_columns)
+
+
+def test_crosstab_frame():
+    df = screen_table()
+    crosstab = Crosstab(df)
+
+    for cutoff in [None, 4, 6, 10]:
+        values = df.Normalized.values if cutoff is None else threshold_values(df, df.Normalized.values, 'Z_Score', cutoff)
+        pd.testing.assert_frame_equal(crosstab.frame(values), pivot(df, values), check_dtype=False)
+
+def test_crosstab_rows():
+    df = screen_table()
+    crosstab = Crosstab(df)
+
+    # B3 and the preys and baits with missing keys are left out
+    assert list(crosstab_rows(crosstab, crosstab.matrix(df.Normalized))) == [
+        [None, None, 'BaitFamily', 'F1', 'F2'],
+        [None, None, 'BaitSubfamily', 'S1', 'S2'],
+        ['PreyFamily', 'PreySubfamily', 'Prey vs Bait', 'B1', 'B2'],
+        ['F1', 'S1', 'P1', 2.0, 4.0],
+        ['F1', 'S1', 'P2', 2.0, 0],
+        ['F2', 'S2', 'P3', 0, 5.0],
+    ]
@@ -0,0 +1,35 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from platero.kinetics import plate_kinetics, KINETIC_COLUMNS
+
+
+def reads_frame():
+    """ Reads of a plate every minute: a linear well, a well with a missing read and an empty well """
+    return pd.DataFrame([
+        [datetime.time(0, 0), 25.0, 0.0, 1.0, np.nan],
+        [datetime.time(0, 1), 25.0, 2.0, np.nan, np.nan],
+        [datetime.time(0, 2), 25.0, 4.0, 3.0, np.nan],
+        [datetime.time(0, 3), 25.0, 6.0, 5.0, np.nan],
+    ], columns=['Time', 'T Lum', 'A1', 'A2', 'A3'])
+
+
+def test_plate_kinetics():
+    features = plate_kinetics(reads_frame(), ['A1', 'A2', 'A3'])
+
+    assert list(features) == KINETIC_COLUMNS
+    # A2: least squares over (0, 1), (2, 3) and (3, 5) only
+    np.testing.assert_allclose(features['Slope'], [2, 9 / 7, np.nan])
+    # A2: the segments next to the missing read are left out
+    np.testing.assert_allclose(features['AUC'], [1 + 3 + 5, (3 + 5) / 2, np.nan])
+    np.testing.assert_allclose(features['MaxSignal'], [6, 5, np.nan])
+    # Half of the max signal: 3 and 2.5
+    np.testing.assert_allclose(features['TimeToThreshold'], [2, 2, np.nan])
+
+def test_plate_kinetics_threshold():
+    features = plate_kinetics(reads_frame(), ['A2', 'A1'], threshold=4)
+
+    np.testing.assert_allclose(features['TimeToThreshold'], [3, 2])
+    np.testing.assert_allclose(features['AUC'], [4, 9])
@@ -0,0 +1,76 @@
+import pytest
+
+from platero.wellplate import (GEOMETRIES, NEG_CONTROL, POS_CONTROL, BAIT_STORAGE_LAYOUT,
+                               PREY_STORAGE_LAYOUT, SCREEN_LAYOUT, BaitStoragePlate,
+                               PreyStoragePlate, ScreenPlate)
+
+ROWS = 'ABCDEFGH'
+PREYS = ['P{}'.format(i) for i in range(46)]
+BAITS = ['B{}'.format(i) for i in range(12)]
+
+
+def prey_wells(preys):
+    """ Wells of a 96 wells prey plate: the same prey in both halves, column by column """
+    wells = {}
+    cells = [(row, column) for column in range(1, 7) for row in ROWS]
+    for prey, (row, column) in zip(preys, cells):
+        wells['{}{}'.format(row, column)] = prey
+        wells['{}{}'.format(row, column + 6)] = prey
+    return wells
+
+
+def test_compiled_layout_capacity():
+    geometry = GEOMETRIES[96]
+
+    assert PREY_STORAGE_LAYOUT.compile(geometry).capacity == 46
+    assert BAIT_STORAGE_LAYOUT.compile(geometry).capacity == 12
+    assert SCREEN_LAYOUT.compile(geometry).capacity == 2
+    assert PreyStoragePlate.capacity(GEOMETRIES[384]) == 190
+    assert BaitStoragePlate.capacity(GEOMETRIES[384]) == 24
+
+
+@pytest.mark.parametrize('count', [1, 8, 23, 46])
+def test_prey_storage_layout(count):
+    plate = PreyStoragePlate(PREYS[:count])
+    expected = prey_wells(PREYS[:count])
+
+    assert {cell: value for cell, value in plate.values.items() if value} == expected
+    # The last two wells of each half are kept for the screen controls
+    assert not any(plate.get(cell) for cell in ['G6', 'H6', 'G12', 'H12'])
+
+
+@pytest.mark.parametrize('count', [1, 5, 12])
+def test_bait_storage_layout(count):
+    plate = BaitStoragePlate(BAITS[:count])
+    expected = {'{}{}'.format(row, column + 1): bait
+                for column, bait in enumerate(BAITS[:count]) for row in ROWS}
+
+    assert {cell: value for cell, value in plate.values.items() if value} == expected
+
+
+@pytest.mark.parametrize('count', [1, 2])
+def test_screen_layout(count):
+    prey_plate = PreyStoragePlate(PREYS)
+    prey_plate.name = 'prey'
+    baits = BAITS[:count]
+    plate = ScreenPlate(baits, 'bait', 3, prey_plate)
+
+    wells = prey_wells(PREYS)
+    for column in range(1, 13):
+        half = (column - 1) // 6
+        for row in ROWS:
+            cell = '{}{}'.format(row, column)
+            if half < count:
+                expected = {'bait': baits[half], 'prey': wells.get(cell, '')}
+            else:
+                expected = {'bait': None, 'prey': None}
+            if cell == 'H12':
+                expected = {'bait': POS_CONTROL, 'prey': POS_CONTROL}
+            elif cell in ('G6', 'G12') and half < count:
+                # Negative controls replace the prey only, the bait is kept
+                expected = {'bait': baits[half], 'prey': NEG_CONTROL}
+            assert plate.get(cell) == expected, cell
+
+    # The baits are pipetted from the columns after the offset
+    assert {cell: value for cell, value in plate.bait_plate.values.items() if value} == \
+        {'{}{}'.format(row, column + 4): bait for column, bait in enumerate(baits) for row in ROWS}
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from platero.platero import db, get_engine, db_reset
+from platero.model import utils as model_utils
+from platero.model.models import BatchProtein, PlateCell, Protein
+from platero.model.queries import get_plates
+from platero.model.utils import bulk_upsert
+
+
+def query_plan(query):
+    """ Details of the SQLite query plan of an ORM query """
+    compiled = query.statement.compile(bind=get_engine())
+    params = [compiled.params[name] for name in compiled.positiontup]
+
+    connection = get_engine().raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+def uses_index(plan, index):
+    return any('USING INDEX {}'.format(index) in step or 'USING COVERING INDEX {}'.format(index) in step
+               for step in plan)
+
+
+def test_batch_proteins_index():
+    query = db.query(BatchProtein).filter(BatchProtein.batch_id == 1, BatchProtein.cloned == 'yes').\
+        order_by(BatchProtein.order)
+    plan = query_plan(query)
+
+    assert uses_index(plan, 'ix_batch_protein_batch')
+    assert not any('TEMP B-TREE' in step for step in plan)
+
+def test_protein_batch_index():
+    query = db.query(BatchProtein).filter(BatchProtein.protein_id == 'AT1G01010', BatchProtein.batch_id == 1)
+
+    assert uses_index(query_plan(query), 'ix_batch_protein_protein')
+
+def test_plates_index():
+    assert uses_index(query_plan(get_plates(1, 2)), 'ix_plate_batches')
+
+def test_plate_cells_indexes():
+    assert uses_index(query_plan(db.query(PlateCell).filter(PlateCell.bait_id == 'AT1G01010')),
+                      'ix_plate_cells_bait')
+    assert uses_index(query_plan(db.query(PlateCell).filter(PlateCell.prey_id == 'AT1G01010')),
+                      'ix_plate_cells_prey')
+
+
+@pytest.mark.parametrize('upsert', sorted({False, model_utils.SQLITE_UPSERT}))
+def test_bulk_upsert(monkeypatch, upsert):
+    monkeypatch.setattr(model_utils, 'SQLITE_UPSERT', upsert)
+    try:
+        db.add(Protein(id='AT1G01010', symbol='NAC001', nickname='N1', family='NAC'))
+        db.commit()
+
+        rows = pd.DataFrame([{'id': 'AT1G01010', 'symbol': 'ANAC001', 'nickname': 'N1'},
+                             {'id': 'AT1G01020', 'symbol': 'ARV1', 'nickname': np.nan}])
+        assert bulk_upsert(db, Protein, rows) == (1, 1)
+        db.commit()
+
+        proteins = [(p.id, p.symbol, p.nickname, p.family) for p in db.query(Protein).order_by(Protein.id)]
+        # Columns not given are kept for the existing rows
+        assert proteins == [('AT1G01010', 'ANAC001', 'N1', 'NAC'), ('AT1G01020', 'ARV1', None, None)]
+
+        batch_proteins = [{'batch_name': '01', 'batch_id': '1', 'protein_id': 'AT1G01010', 'order': 1},
+                          {'batch_name': '01', 'batch_id': '1', 'protein_id': 'AT1G01020', 'order': 2}]
+        assert bulk_upsert(db, BatchProtein, batch_proteins) == (2, 0)
+        assert bulk_upsert(db, BatchProtein, [dict(batch_proteins[1], order=3)], update_columns=[]) == (0, 1)
+        assert bulk_upsert(db, BatchProtein, [dict(batch_proteins[1], order=4)]) == (0, 1)
+        db.commit()
+
+        assert [(b.protein_id, b.order) for b in db.query(BatchProtein).order_by(BatchProtein.order)] == \
+            [('AT1G01010', 1), ('AT1G01020', 4)]
+    finally:
+        db_reset()
@@ -1,3 +1,22 @@
+import datetime
+import logging
+
+import numpy as np
+
+from platero.parsing.parsing import read_plate_block, reads_frame
+
+
+class ListSheet(object):
+    """ Same interface as the xlrd sheets used by the parser, from a list of rows """
+    def __init__(self, rows):
+        width = max(len(row) for row in rows)
+        self.rows = [list(row) + [''] * (width - len(row)) for row in rows]
+
+    def row_values(self, rowx, start_colx=0, end_colx=None):
+        return self.rows[rowx][start_colx:end_colx]
+
+    def col_values(self, colx, start_rowx=0, end_rowx=None):
+        return [row[colx] for row in self.rows[start_rowx:end_rowx]]
 
 
 def test_failing():
@@ -5,3 +24,24 @@ def test_failing():
 
 def test_passing():
     pass
+
+def test_read_plate_block_non_numeric(caplog):
+    sheet = ListSheet([
+        ['Reader', 'Synergy'],
+        ['', 'Time', 'T Lum', 'A1', 'A2'],
+        ['', 0.0, 25.0, 10.5, 'OVRFLW'],
+        ['', 60 / 86400, 25.0, '', 12.0],
+    ])
+
+    with caplog.at_level(logging.WARNING):
+        columns, seconds, values = read_plate_block(sheet, 1, 'plate_00001_results.xls')
+
+    assert columns == ['Time', 'T Lum', 'A1', 'A2']
+    assert seconds.tolist() == [0, 60]
+    np.testing.assert_array_equal(values, [[25.0, 10.5, np.nan], [25.0, np.nan, 12.0]])
+    # Only the non numeric reads are reported, not the empty ones
+    assert "A2 at 00:00:00: 'OVRFLW'" in caplog.text
+    assert 'A1' not in caplog.text
+
+    reads = reads_frame(columns, seconds, values)
+    assert reads.Time.tolist() == [datetime.time(0, 0), datetime.time(0, 1)]
@@ -1,3 +1,8 @@
+import pytest
+
+from platero import platero as app
+from platero.platero import db, db_backup, db_restore, db_reset
+from platero.model.models import Protein
 
 
 def test_failing():
@@ -5,3 +10,21 @@ def test_failing():
 
 def test_passing():
     pass
+
+@pytest.mark.parametrize('backup_api', sorted({False, app.SQLITE_BACKUP_API}))
+def test_db_backup_restore(tmpdir, monkeypatch, backup_api):
+    monkeypatch.setattr(app, 'SQLITE_BACKUP_API', backup_api)
+    filepath = str(tmpdir.join('db', 'snapshot.db'))
+    try:
+        db.add(Protein(id='AT1G01010', symbol='NAC001', nickname='N1'))
+        db.commit()
+        db_backup(filepath)
+
+        db.query(Protein).delete()
+        db.add(Protein(id='AT1G01020', symbol='ARV1', nickname='N2'))
+        db.commit()
+        db_restore(filepath)
+
+        assert [(p.id, p.nickname) for p in db.query(Protein)] == [('AT1G01010', 'N1')]
+    finally:
+        db_reset()
@@ -0,0 +1,22 @@
+import logging
+
+from platero.pool import ProcessingPool, worker_state
+
+
+def scaled_task(value):
+    root = logging.getLogger()
+    return value * worker_state['scale'], [type(handler).__name__ for handler in root.handlers], root.level
+
+
+def test_processing_pool():
+    with ProcessingPool(1, scale=2) as pool:
+        assert [result[0] for result in pool.imap(scaled_task, range(5))] == [0, 2, 4, 6, 8]
+
+def test_processing_pool_workers():
+    logging.getLogger().setLevel(logging.WARNING)
+    with ProcessingPool(2, scale=3) as pool:
+        results = list(pool.imap(scaled_task, range(5)))
+
+    assert [value for value, handlers, level in results] == [0, 3, 6, 9, 12]
+    # Spawned workers only log to the console, at the level of the parent
+    assert all(handlers == ['StreamHandler'] and level == logging.WARNING for value, handlers, level in results)
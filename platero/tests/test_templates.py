@@ -0,0 +1,152 @@
+import datetime
+import zipfile
+from collections import OrderedDict
+
+import pytest
+from openpyxl import load_workbook
+
+from platero.assets import SCREEN_PLATE_TEMPLATE, STORAGE_PLATE_TEMPLATE, xls_template
+from platero.model.models import ProteinRow
+from platero.templates import TemplateWorkbook, get_template_archive, range_cells, add_missing_cells, \
+    excel_serial, EXCEL_EPOCH, scale_template, cell_position, item_labels, render_screen_plate, \
+    export_screen_plate, export_storage_plate, SCREEN_RANGES
+from platero.wellplate import GEOMETRIES, PreyStoragePlate, ScreenPlate
+
+
+def sheet_titles(wb):
+    return [ws.title for ws in wb.worksheets]
+
+def info_values(wb):
+    ws = wb.worksheets[sheet_titles(wb).index('Info')]
+    return OrderedDict((row[0].value, row[1].value) for row in ws.iter_rows() if row[0].value)
+
+def range_values(wb, archive, range_name):
+    """ Values of the cells of a named range, as resolved from the template """
+    return [wb.worksheets[sheet_titles(wb).index(sheet)][ref].value for sheet, ref in archive.named_range(range_name)]
+
+def is_time(value, expected):
+    # NOTE: time only cells may be read as datetimes of the Excel epoch
+    return value in (expected, datetime.datetime.combine(EXCEL_EPOCH.date(), expected))
+
+
+def test_range_cells():
+    assert range_cells('Pipetting!$A$1,Pipetting!$A$3') == [('Pipetting', 'A1'), ('Pipetting', 'A3')]
+    assert range_cells("'My sheet'!$B$5:$C$6") == [('My sheet', 'B5'), ('My sheet', 'C5'),
+                                                   ('My sheet', 'B6'), ('My sheet', 'C6')]
+
+def test_add_missing_cells():
+    xml = '<sheetData><row r="2"><c r="A2"/><c r="C2"/></row><row r="4"/></sheetData>'
+    patched = add_missing_cells(xml, {'B2', 'A3', 'B4', 'A5'})
+
+    assert patched == ('<sheetData><row r="2"><c r="A2"/><c r="B2"/><c r="C2"/></row>'
+                       '<row r="3"><c r="A3"/></row><row r="4"><c r="B4"/></row>'
+                       '<row r="5"><c r="A5"/></row></sheetData>')
+
+def test_excel_serial():
+    assert excel_serial(datetime.time(12, 0)) == 0.5
+    assert excel_serial(datetime.date(1900, 1, 1)) == 2
+    assert excel_serial(datetime.datetime(1900, 1, 1, 6)) == 2.25
+
+def test_screen_template_round_trip(tmpdir):
+    archive = get_template_archive(SCREEN_PLATE_TEMPLATE)
+    proteins = ['AT1G{:05d} / AT2G{:05d}'.format(i, i) if i % 3 else '' for i in range(96)]
+
+    wb = TemplateWorkbook(SCREEN_PLATE_TEMPLATE)
+    wb.set_cell_range('Template', 'rng_template_labels', ['Plate: <1> & "2"'])
+    wb.set_cell_range('Template', 'rng_template_proteins', proteins)
+    wb.set_cell_range('Pipetting', 'rng_pipetting_labels', ['Plate', 'Bait', 3.5])
+    wb.set_info(OrderedDict([('Plate name', 'plate_1'), ('Timeshift', datetime.time(0, 30)),
+                             ('Imported', datetime.datetime(2016, 1, 2, 3, 4)), ('Replicate', 2)]))
+    filename = str(tmpdir.join('plate_1.xlsx'))
+    wb.save(filename)
+
+    result = load_workbook(filename)
+    assert sheet_titles(result) == ['Template', 'Pipetting', 'Info']
+    assert range_values(result, archive, 'rng_template_labels') == ['Plate: <1> & "2"']
+    assert range_values(result, archive, 'rng_template_proteins') == [value or None for value in proteins]
+    assert range_values(result, archive, 'rng_pipetting_labels') == ['Plate', 'Bait', 3.5]
+    # Cells not set keep their template values
+    assert range_values(result, archive, 'rng_template_nicknames') == [None] * 96
+    assert result.worksheets[0]['A5'].value == 'A'
+
+    info = info_values(result)
+    assert list(info) == ['Plate name', 'Timeshift', 'Imported', 'Replicate', 'Generated By', 'Generated On']
+    assert is_time(info['Timeshift'], datetime.time(0, 30))
+    assert info['Imported'] == datetime.datetime(2016, 1, 2, 3, 4)
+    assert info['Replicate'] == 2
+
+def test_remove_sheet(tmpdir):
+    wb = TemplateWorkbook(SCREEN_PLATE_TEMPLATE)
+    wb.set_cell_range('Template', 'rng_template_labels', ['Plate: 1'])
+    wb.remove_sheet_by_name('Pipetting')
+    wb.set_info(OrderedDict())
+    filename = str(tmpdir.join('plate_1.xlsx'))
+    wb.save(filename)
+
+    with zipfile.ZipFile(filename) as archive:
+        workbook = archive.read('xl/workbook.xml').decode('utf-8')
+        assert 'xl/worksheets/sheet2.xml' not in archive.namelist()
+        assert 'sheet2.xml' not in archive.read('[Content_Types].xml').decode('utf-8')
+    assert 'Pipetting' not in workbook
+    assert 'rng_template_labels' in workbook
+
+    result = load_workbook(filename)
+    assert sheet_titles(result) == ['Template', 'Info']
+    assert result.worksheets[0]['A1'].value == 'Plate: 1'
+
+def test_storage_template_round_trip(tmpdir):
+    archive = get_template_archive(STORAGE_PLATE_TEMPLATE)
+    nicknames = ['N{}'.format(i) for i in range(96)]
+
+    wb = TemplateWorkbook(STORAGE_PLATE_TEMPLATE)
+    wb.set_cell_range('Proteins', 'rng_nicknames', nicknames)
+    wb.set_info(OrderedDict([('Plate name', 'batch_01_prey')]))
+    filename = str(tmpdir.join('batch_01_prey.xlsx'))
+    wb.save(filename)
+
+    result = load_workbook(filename)
+    assert sheet_titles(result) == ['Proteins', 'Info']
+    assert range_values(result, archive, 'rng_nicknames') == nicknames
+    assert info_values(result)['Plate name'] == 'batch_01_prey'
+
+@pytest.mark.parametrize('size', sorted(GEOMETRIES))
+def test_plate_size_templates_round_trip(tmpdir, size):
+    geometry = GEOMETRIES[size]
+    proteins = [ProteinRow('AT1G{:05d}'.format(i), 'S{}'.format(i), 'N{}'.format(i), '', '')
+                for i in range(PreyStoragePlate.capacity(geometry))]
+    prey_plate = PreyStoragePlate(proteins, geometry)
+    prey_plate.name = 'batch_01_prey'
+    screen_plate = ScreenPlate(proteins[:ScreenPlate.capacity(geometry)], 'batch_02_bait_1', 0, prey_plate)
+    screen_plate.name = 'plate_00001'
+
+    storage_file, screen_file = str(tmpdir.join('storage.xlsx')), str(tmpdir.join('screen.xlsx'))
+    export_storage_plate(storage_file, prey_plate, OrderedDict([('Plate name', prey_plate.name)]))
+    export_screen_plate(screen_file, screen_plate, OrderedDict([('Plate name', screen_plate.name)]))
+
+    archive = get_template_archive(xls_template('storage', size))
+    result = load_workbook(storage_file)
+    assert range_values(result, archive, 'rng_nicknames') == [value or None for value in
+                                                              item_labels(prey_plate.cell_values(), 'nickname')]
+    assert range_values(result, archive, 'rng_labels') == ['Plate: batch_01_prey']
+
+    archive = get_template_archive(xls_template('screen', size))
+    ranges = render_screen_plate(screen_plate)
+    result = load_workbook(screen_file)
+    for sheet, range_name in SCREEN_RANGES:
+        assert range_values(result, archive, range_name) == [value or None for value in ranges[range_name]]
+    assert info_values(result)['Plate name'] == 'plate_00001'
+
+    # Row labels and column numbers around the wells
+    ws = result.worksheets[0]
+    first_row, first_column = cell_position(archive.named_range('rng_template_proteins')[0][1])
+    assert [ws.cell(row=first_row + i, column=first_column).value for i in range(geometry.shape[0])] == list(geometry.rows)
+    assert [ws.cell(row=first_row - 1, column=first_column + 1 + j).value for j in range(geometry.shape[1])] == \
+        list(range(1, geometry.shape[1] + 1))
+
+def test_scale_template(tmpdir):
+    filename = str(tmpdir.join('384wp_screen_template.xlsx'))
+    scale_template(SCREEN_PLATE_TEMPLATE, filename, GEOMETRIES[384])
+
+    # The shipped templates are generated from the 96 well ones
+    with open(filename, 'rb') as generated, open(xls_template('screen', 384), 'rb') as shipped:
+        assert generated.read() == shipped.read()
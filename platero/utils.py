@@ -2,6 +2,7 @@
 # GENERAL
 #
 
+import hashlib
 import logging
 import os, re
 import sys
@@ -41,6 +42,26 @@ def filter_digits(str):
     return int(''.join(x for x in str if x.isdigit()))
 
 
+def file_hash(filepath, block_size=2**20):
+    """
+    Hex digest of the contents of a file (SHA-1)
+    """
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def chunks(items, size):
+    """
+    Split a list in consecutive chunks of a given size
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
 def bundled_app():
     """ Checks if an app is running as bundled """
     return hasattr(sys, '_MEIPASS')
@@ -98,6 +119,45 @@ def assert_empty_df(df, message, columns=None, n_lines=10):
         raise ValueError(exc_message)
 
 
+class DataFrameCollector(object):
+    """
+    Collects data frames (e.g. the results of each plate) and builds the
+    final data frame at once, instead of copying the accumulated data on
+    every append
+    """
+    def __init__(self, name='results'):
+        self.name = name
+        self.frames = []
+        self.n_rows = 0
+        self.memory_usage = 0
+
+    def append(self, df):
+        """ Add a data frame to the collection, empty ones are ignored """
+        if df is None or df.empty:
+            return
+
+        self.frames.append(df)
+        self.n_rows += len(df)
+        self.memory_usage += df.memory_usage(index=True, deep=True).sum()
+        logging.debug("Collected {} rows of {} ({:.2f} MB)".format(
+            self.n_rows, self.name, self.memory_usage / 2**20))
+
+    def __len__(self):
+        return self.n_rows
+
+    def to_frame(self):
+        """ Concatenate all the collected data frames """
+        import pandas as pd
+
+        if not self.frames:
+            return pd.DataFrame()
+
+        logging.info("Building {} table: {} rows from {} parts ({:.2f} MB)".format(
+            self.name, self.n_rows, len(self.frames), self.memory_usage / 2**20))
+
+        return pd.concat(self.frames, ignore_index=True)
+
+
 #
 # DATE & TIME
 #
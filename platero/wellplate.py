@@ -1,37 +1,139 @@
-
 from collections import OrderedDict
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from .layouts import PlateLayout, Control, WHOLE_PLATE, HALVES
 
 NEG_CONTROL = '[NC]'
 POS_CONTROL = '[PC]'
 
+class WellTable(object):
+    """
+    Precomputed names and coordinates of the wells of a plate. Wells are
+    numbered row by row (flat index). Tables are shared by all the plates
+    with the same rows and columns, see WellTable.get
+    """
+    _tables = {}
+
+    def __init__(self, rows, columns):
+        self.rows = tuple(rows)
+        self.columns = tuple(columns)
+        self.shape = (len(self.rows), len(self.columns))
+        self.size = len(self.rows) * len(self.columns)
+
+        self.row_index = {row: i for i, row in enumerate(self.rows)}
+        self.column_index = {str(column): j for j, column in enumerate(self.columns)}
+
+        # Name <-> flat index
+        self.names = ["{}{}".format(row, column) for row in self.rows for column in self.columns]
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+        # Flat index -> row and column (0-indexed)
+        wells = np.arange(self.size)
+        self.well_rows, self.well_columns = wells // len(self.columns), wells % len(self.columns)
+
+    @classmethod
+    def get(cls, rows, columns):
+        """ Shared well table for the given rows and columns """
+        key = (tuple(rows), tuple(columns))
+        if key not in cls._tables:
+            cls._tables[key] = cls(*key)
+
+        return cls._tables[key]
+
+    def flat_index(self, i, j):
+        """ Flat index of a well, based on 0-indexed row and column numbers """
+        return i * len(self.columns) + j
+
+
+class WellValues(MutableMapping):
+    """
+    Dictionary view of the values of a plate, by cell name and in the order of
+    the wells. Updates are written through to the plate.
+    """
+    def __init__(self, plate):
+        self.plate = plate
+
+    def __getitem__(self, cell):
+        return self.plate.get(cell)
+
+    def __setitem__(self, cell, value):
+        self.plate.set(cell, value)
+
+    def __delitem__(self, cell):
+        raise TypeError("Wells can't be removed from a plate")
+
+    def __iter__(self):
+        return iter(self.plate.wells.names)
+
+    def __len__(self):
+        return self.plate.wells.size
+
+    def items(self):
+        return zip(self.plate.wells.names, self.plate.cell_values())
+
+
 class WellPlate(object):
+    """
+    Plate with a value per well. Values are stored once in a list of items,
+    and the wells hold the codes of their values in a rows x columns array,
+    so whole regions of the plate can be set with a single assignment.
+    """
     def __init__(self, rows, columns, default=None, values={}, name=''):
         self.name = name
         self.rows = rows
         self.columns = columns
+        self.wells = WellTable.get(rows, columns)
         self.init(default)
         self.update(values)
 
     def init(self, default):
         """ Set default values for the plate cells """
-        self.values = OrderedDict()
-        for i, row in enumerate(self.rows):
-            for j, column in enumerate(self.columns):
-                self.values[self.cell_id(i, j)] = default
+        # Code 0 is the default value
+        self.items = [default]
+        self.codes = np.zeros(self.wells.shape, dtype=int)
+
+    def add_items(self, values):
+        """ Add values to the plate items, returning an array with their codes """
+        start = len(self.items)
+        self.items.extend(values)
+        return np.arange(start, len(self.items))
 
     def update(self, values):
         """ Update plate cells values """
-        self.values.update(values)
+        if not values:
+            return
+
+        cells = list(values.keys())
+        index = [self.wells.index[cell] for cell in cells]
+        self.codes.flat[index] = self.add_items([values[cell] for cell in cells])
+
+    def get(self, cell):
+        """ Value of a cell, by name """
+        return self.items[self.codes.flat[self.wells.index[cell]]]
+
+    def set(self, cell, value):
+        """ Set the value of a cell, by name """
+        self.codes.flat[self.wells.index[cell]] = self.add_items([value])[0]
+
+    def cell_values(self):
+        """ List with the values of all the cells, row by row """
+        items = self.items
+        return [items[code] for code in self.codes.ravel().tolist()]
+
+    @property
+    def values(self):
+        return WellValues(self)
 
     def cell_id(self, i, j):
         """ Get the id of a cell, based on 0-indexed row and column numbers """
-        # TODO: check that they are valid indexes?
-        return self.cell_name(self.rows[i], self.columns[j])
+        return self.wells.names[self.wells.flat_index(i, j)]
 
     def cell_name(self, row, column):
         """ Get the id of a cell, based on row and column """
-        # TODO: check that they are valid indexes? Merge with cell_id
-        return "{}{}".format(row, column)
+        return self.wells.names[self.wells.flat_index(self.wells.row_index[row],
+                                                      self.wells.column_index[str(column)])]
 
     def size(self):
         """ Number of wells available """
@@ -43,160 +145,233 @@ class WellPlate(object):
         if self.name:
             as_str = 'Plate: ' + self.name + '\n' + as_str
 
+        values = self.cell_values()
+        n_columns = len(self.columns)
         for i, row in enumerate(self.rows):
             line = row
-            for j, column in enumerate(self.columns):
-                line += '\t' + str(self.values[self.cell_name(row, column)])
+            for value in values[i * n_columns:(i + 1) * n_columns]:
+                line += '\t' + str(value)
             as_str += line + '\n'
 
         return as_str
 
     def to_dict(self):
         """ Convery WellPlate object to dict """
-        return self.values
+        return OrderedDict(zip(self.wells.names, self.cell_values()))
+
+
+class PlateGeometry(WellTable):
+    """
+    Standard plate format, with the index arrays of the plate halves and
+    rotation. The positions of the proteins and controls are defined by the
+    plate layouts (see PlateLayout)
+    """
+    def __init__(self, n_rows, n_columns):
+        super().__init__(row_labels(n_rows), [str(i) for i in range(1, n_columns + 1)])
+
+        # Half of the plate of each well (0: left, 1: right)
+        self.half_index = self.well_columns // (n_columns // 2)
+
+        # Position of each well when the plate is rotated 180 degrees
+        self.rotation = self.size - 1 - np.arange(self.size)
+
+    def well_indexes(self, cells):
+        """ Array with the flat indexes of a list of cell names """
+        return np.array([self.index[cell] for cell in cells], dtype=int)
+
+
+def row_labels(n_rows):
+    """ Row labels of a plate: A-Z, then AA, AB, ... """
+    letters = [chr(ord('A') + i) for i in range(26)]
+    labels = letters + [first + second for first in letters for second in letters]
+    return labels[:n_rows]
+
+
+GEOMETRIES = OrderedDict([
+    (96, PlateGeometry(8, 12)),
+    (384, PlateGeometry(16, 24)),
+    (1536, PlateGeometry(32, 48)),
+])
+# NOTE: plates with the same rows and columns share the geometry as well table
+WellTable._tables.update(((geometry.rows, geometry.columns), geometry) for geometry in GEOMETRIES.values())
+
+def get_geometry(size):
+    """ Plate geometry for a number of wells """
+    try:
+        return GEOMETRIES[size]
+    except KeyError:
+        raise ValueError("Unsupported plate size ({} wells), use one of: {}".format(
+            size, ', '.join(str(size) for size in GEOMETRIES)))
+
+
+class StandardPlate(WellPlate):
+    """
+    Plate with one of the standard geometries, 96 wells unless another
+    geometry is given
+    """
+    geometry = GEOMETRIES[96]
 
+    def __init__(self, default='', values={}, geometry=None):
+        if geometry is not None:
+            self.geometry = geometry
+        super().__init__(list(self.geometry.rows), list(self.geometry.columns), default, values)
 
-class WellPlate96(WellPlate):
+
+class WellPlate96(StandardPlate):
     rows = list('ABCDEFGH')
     columns = [str(i) for i in range(1,13)]
 
     def __init__(self, default='', values={}):
-        super().__init__(WellPlate96.rows, WellPlate96.columns, default, values)
+        super().__init__(default, values)
 
     @classmethod
     def size(cls):
         """ Number of wells available """
         return len(cls.rows) * len(cls.columns)
 
-class PreyStoragePlate(WellPlate96):
+# A prey storage plate is divided in two equal areas with the same
+# configuration of proteins, filled column by column, keeping space for the
+# controls of the screen plates
+PREY_STORAGE_LAYOUT = PlateLayout(HALVES, fill='columns', unit='well', reserved=2)
+
+# Each bait fills up one column of a bait storage plate
+BAIT_STORAGE_LAYOUT = PlateLayout(WHOLE_PLATE, fill='columns', unit='line')
+
+# A screen plate has a bait in each half, with the preys of the same wells of
+# the prey storage plate. Each half with a bait has a negative control in its
+# second to last well, and the last well of the plate is the positive control
+SCREEN_LAYOUT = PlateLayout(HALVES, fill='columns', unit='region', controls=[
+    Control(NEG_CONTROL, slot=-2, regions='filled', layers=['prey']),
+    Control(POS_CONTROL, slot=-1, regions='last', layers=['bait', 'prey']),
+])
+
+
+class PreyStoragePlate(StandardPlate):
     """
-    A prey storage plate stores up to 46 proteins. The plate is divided in two
-    equal areas with the same configuration of proteins,
+    A prey storage plate stores up to 46 proteins (in 96 wells). The plate is
+    divided in two equal areas with the same configuration of proteins,
     """
-    def __init__(self, preys):
-        super().__init__()
+    layout = PREY_STORAGE_LAYOUT
+
+    def __init__(self, preys, geometry=None):
+        super().__init__(geometry=geometry)
         self.preys = preys
 
         if len(preys) == 0:
             raise ValueError("No prey proteins provided to initialize the plate")
 
-        elif len(preys) > self.__class__.capacity():
-            raise ValueError("Plate can only store up to {capacity} prey proteins, {given} provided".format(given=len(preys), capacity=self.capacity()))
-
-        wells = {}
-        i = 0
-        half = len(self.columns) // 2
-        # TODO : What a piece of ugly code! don't do this with an exception!
-        try:
-            for col_A, col_B in zip(self.columns[:half], self.columns[half:]):
-                for row in self.rows:
-                    wells[self.cell_name(row, col_A)] = preys[i]
-                    wells[self.cell_name(row, col_B)] = preys[i]
-                    i += 1
-                    if i == len(preys):
-                        raise ValueError()
-        except ValueError:
-            pass
-
-        self.update(wells)
+        elif len(preys) > self.capacity(self.geometry):
+            raise ValueError("Plate can only store up to {capacity} prey proteins, {given} provided".format(given=len(preys), capacity=self.capacity(self.geometry)))
+
+        self.layout.compile(self.geometry).fill(self.codes, self.add_items(preys))
 
     @classmethod
-    def capacity(cls):
+    def capacity(cls, geometry=None):
         """
         Number of proteins that can be stored in the plate. We split the plate
         in 2 and keep space for the controls
         """
-        return (cls.size() // 2) - 2
+        return cls.layout.compile(geometry or cls.geometry).capacity
 
 
-class BaitStoragePlate(WellPlate96):
+class BaitStoragePlate(StandardPlate):
     """
-    A bait storage plate stores up to 12 proteins. A whole column
+    A bait storage plate stores up to 12 proteins (in 96 wells). A whole column
     is filled with the same bait protein.
     """
-    def __init__(self, baits):
-        super().__init__()
-        self.baits = baits
+    layout = BAIT_STORAGE_LAYOUT
 
-        if len(baits) > self.capacity():
-            raise ValueError("Plate can only store up to {capacity} bait proteins, {given} provided".format(given=len(baits), capacity=self.capacity()))
+    def __init__(self, baits, geometry=None):
+        super().__init__(geometry=geometry)
+        self.baits = baits
 
-        wells = {}
-        i = 0
-        for i, protein, column in zip(range(len(baits)), baits, self.columns):
-            for row in self.rows:
-                wells[self.cell_name(row, column)] = baits[i]
+        if len(baits) > self.capacity(self.geometry):
+            raise ValueError("Plate can only store up to {capacity} bait proteins, {given} provided".format(given=len(baits), capacity=self.capacity(self.geometry)))
 
-        self.update(wells)
+        self.layout.compile(self.geometry).fill(self.codes, self.add_items(baits))
 
     @classmethod
-    def capacity(cls):
+    def capacity(cls, geometry=None):
         """
         Number of proteins that can be stored in the plate. Each bait fills up one column
         """
-        return len(cls.columns)
+        return cls.layout.compile(geometry or cls.geometry).capacity
 
     @classmethod
-    def bait_plate_index(cls, bait_index):
+    def bait_plate_index(cls, bait_index, geometry=None):
         """ Plate index given an index in the batch proteins list (1-indexed) """
-        return (bait_index // cls.capacity()) + 1
+        return (bait_index // cls.capacity(geometry)) + 1
 
     @classmethod
-    def bait_plate_offset(cls, bait_index):
+    def bait_plate_offset(cls, bait_index, geometry=None):
         """ Column offset given an index in the batch proteins list (0-indexed) """
-        return (bait_index % cls.capacity())
+        return (bait_index % cls.capacity(geometry))
 
 
 
-class ScreenPlate(WellPlate96):
+class ScreenPlate(StandardPlate):
     """
-    A screen plate combines 2 bait proteins with a prey storage plate (a full batch)
+    A screen plate combines 2 bait proteins with a prey storage plate (a full batch),
+    with the same geometry as the prey plate. The values of the cells are the
+    interactions, as {'bait': ..., 'prey': ...}
     """
+    layout = SCREEN_LAYOUT
+
     def __init__(self, baits, bait_plate_name, bait_plate_offset, prey_plate):
         # TODO: refactor this class, cleaner params
-        super().__init__(default={'bait':None, 'prey': None})
+        geometry = prey_plate.geometry
+        if len(baits) > self.capacity(geometry):
+            raise ValueError("Plate can only store up to {capacity} bait proteins, {given} provided".format(given=len(baits), capacity=self.capacity(geometry)))
+
+        super().__init__(default=None, geometry=geometry)
 
         self.baits = baits
         self.bait_plate_name = bait_plate_name
-        self.bait_plate_offset = bait_plate_name
+        self.bait_plate_offset = bait_plate_offset
         # Create a simulated plate with the stuff to pipette for baits
         # TODO: maybe different default value
-        bait_plate = WellPlate96()
-        for i, column in enumerate(WellPlate96.columns[bait_plate_offset:bait_plate_offset + len(baits)]):
-            for row in WellPlate96.rows:
-                bait_plate.values[bait_plate.cell_name(row, column)] = baits[i]
+        bait_plate = StandardPlate(geometry=geometry)
+        BAIT_STORAGE_LAYOUT.compile(geometry).fill(bait_plate.codes, bait_plate.add_items(baits), start=bait_plate_offset)
         self.bait_plate = bait_plate
 
         self.prey_plate = prey_plate
         self.prey_plate_name = prey_plate.name
 
-        if len(baits) >  2:
-            raise ValueError("Plate can only store up to 2 bait proteins, {given} provided".format(given=len(baits)))
-
-        wells = {}
-        half = len(self.columns) // 2
-        for col_A, col_B in zip(self.columns[:half], self.columns[half:]):
-            for row in self.rows:
-                cell_A = self.cell_name(row, col_A)
-                cell_B = self.cell_name(row, col_B)
+        # Bait and prey of each well
+        layout = self.layout.compile(geometry)
+        self.bait_wells = StandardPlate(default=None, geometry=geometry)
+        layout.fill(self.bait_wells.codes, self.bait_wells.add_items(baits))
 
-                wells[cell_A] = {'bait': baits[0], 'prey': prey_plate.values[cell_A]}
-                if len(baits) > 1:
-                    wells[cell_B] = {'bait': baits[1], 'prey': prey_plate.values[cell_B]}
+        self.prey_wells = StandardPlate(default=None, geometry=geometry)
+        self.prey_wells.items.extend(prey_plate.items)
+        wells = layout.filled_wells(len(baits))
+        self.prey_wells.codes.flat[wells] = prey_plate.codes.flat[wells] + 1
 
         # Controls go into fixed positions
-        wells["G6"] = {'bait': baits[0], 'prey': NEG_CONTROL}
-        if len(baits) > 1:
-            wells["G12"] = {'bait': baits[1], 'prey': NEG_CONTROL}
+        layers = {'bait': self.bait_wells, 'prey': self.prey_wells}
+        for control, wells in layout.controls(len(baits)):
+            for layer in control.layers:
+                layers[layer].codes.flat[wells] = layers[layer].add_items([control.value])[0]
 
-        wells["H12"] = {'bait': POS_CONTROL, 'prey': POS_CONTROL}
+    def get(self, cell):
+        return {'bait': self.bait_wells.get(cell), 'prey': self.prey_wells.get(cell)}
 
-        self.update(wells)
+    def set(self, cell, value):
+        value = value or {'bait': None, 'prey': None}
+        self.bait_wells.set(cell, value['bait'])
+        self.prey_wells.set(cell, value['prey'])
+
+    def update(self, values):
+        for cell, value in values.items():
+            self.set(cell, value)
 
+    def cell_values(self):
+        return [{'bait': bait, 'prey': prey} for bait, prey in
+                zip(self.bait_wells.cell_values(), self.prey_wells.cell_values())]
 
     @classmethod
-    def capacity(cls):
+    def capacity(cls, geometry=None):
         """
         Number of bait proteins that can be stored in the plate
         """
-        return WellPlate96.size() // PreyStoragePlate.capacity()
+        return cls.layout.compile(geometry or cls.geometry).capacity
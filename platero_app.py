@@ -2,6 +2,7 @@
 
 import os
 import logging
+import multiprocessing
 from configparser import ConfigParser
 
 import tkinter as tk
@@ -10,7 +11,8 @@ from tkinter import filedialog as tkdialog
 from tkinter import messagebox as tkmessagebox
 
 from platero.utils import setup_logging, resource_path, bundled_app
-from process_plates import process_plates, RESULTS_FILENAME
+from platero.platero import config as platero_config
+from process_plates import process_plates, results_filename, AVAILABLE_EXPORT_FORMATS
 
 
 def pad_all(widget):
@@ -133,6 +135,15 @@ class PlateroGUI(ttk.Frame):
         self.wdg_proteinsList.selectedPath.trace("w", self.enable_actions)
         self.wdg_outputFolder = SelectPath(self, "Output folder", True)
         self.wdg_outputFolder.selectedPath.trace("w", self.enable_actions)
+        self.wdg_options = ttk.Frame(self)
+        ttk.Label(self.wdg_options, text="Jobs").grid(row=0, column=0, sticky="W")
+        self.jobs = tk.IntVar(value=1)
+        tk.Spinbox(self.wdg_options, from_=1, to=multiprocessing.cpu_count(), textvariable=self.jobs,
+                   width=4, state="readonly").grid(row=0, column=1, sticky="W")
+        ttk.Label(self.wdg_options, text="Format").grid(row=0, column=2, sticky="W")
+        self.export_format = tk.StringVar(value=platero_config.EXPORT_FORMAT)
+        ttk.Combobox(self.wdg_options, textvariable=self.export_format, values=AVAILABLE_EXPORT_FORMATS,
+                     width=8, state="readonly").grid(row=0, column=3, sticky="W")
         self.txt_console = LogConsole(self, height="30", width="160")
 
         self.btn_processPlates = ttk.Button(self, text="Process plates", command=self.start_process, state="disabled")
@@ -141,8 +152,9 @@ class PlateroGUI(ttk.Frame):
         self.wdg_platesFolder.grid(row=0, column=0, sticky="EW")
         self.wdg_proteinsList.grid(row=1, column=0, sticky="EW")
         self.wdg_outputFolder.grid(row=2, column=0, sticky="EW")
-        self.btn_processPlates.grid(row=3, column=0)
-        self.txt_console.grid(row=4, column=0, sticky=tk.NSEW)
+        self.wdg_options.grid(row=3, column=0, sticky="EW")
+        self.btn_processPlates.grid(row=4, column=0)
+        self.txt_console.grid(row=5, column=0, sticky=tk.NSEW)
 
         pad_all(self)
 
@@ -164,7 +176,7 @@ class PlateroGUI(ttk.Frame):
 
         # Check if main output file already exists
         proceed = True
-        if os.path.isfile( os.path.join(self.wdg_outputFolder.path, RESULTS_FILENAME) ):
+        if os.path.isfile( os.path.join(self.wdg_outputFolder.path, results_filename(self.export_format.get())) ):
             proceed = tkmessagebox.askquestion("Please confirm", "A results file already exists in the "+ \
                                      "destination folder and will be overwritten. Are you sure "+ \
                                      "you want to proceed?", icon='warning') == 'yes'
@@ -172,7 +184,8 @@ class PlateroGUI(ttk.Frame):
             self.change_filelog()
             self.txt_console.reset()
             try:
-                process_plates(self.wdg_platesFolder.path, self.wdg_proteinsList.path, self.wdg_outputFolder.path)
+                process_plates(self.wdg_platesFolder.path, self.wdg_proteinsList.path, self.wdg_outputFolder.path,
+                               jobs=self.jobs.get(), export_format=self.export_format.get())
             except Exception as exc:
                 logging.error("Plates couldn't be processed, see error below")
                 logging.exception(exc)
@@ -254,6 +267,10 @@ class PlateroApp(tk.Tk):
             self.app.wdg_platesFolder.path = get_with_default(config, 'options', 'plates_folder')
             self.app.wdg_proteinsList.path = get_with_default(config, 'options', 'proteins_list')
             self.app.wdg_outputFolder.path = get_with_default(config, 'options', 'output_folder')
+            self.app.jobs.set(get_with_default(config, 'options', 'jobs', 1))
+            export_format = get_with_default(config, 'options', 'export_format', platero_config.EXPORT_FORMAT)
+            if export_format in AVAILABLE_EXPORT_FORMATS:
+                self.app.export_format.set(export_format)
 
     def save_config(self):
         with open(self.CONFIG_FILE, 'w') as file:
@@ -262,6 +279,8 @@ class PlateroApp(tk.Tk):
             config.set('options', 'plates_folder', self.app.wdg_platesFolder.path)
             config.set('options', 'proteins_list', self.app.wdg_proteinsList.path)
             config.set('options', 'output_folder', self.app.wdg_outputFolder.path)
+            config.set('options', 'jobs', str(self.app.jobs.get()))
+            config.set('options', 'export_format', self.app.export_format.get())
             config.write(file)
 
 def get_with_default(config, section,name, default=''):
@@ -275,6 +294,8 @@ def get_with_default(config, section,name, default=''):
 
 
 if __name__ == '__main__':
+    # NOTE: needed by the processing pool when running as a bundled app
+    multiprocessing.freeze_support()
     setup_logging(logging.INFO)
     # TODO:
     # 1. Deal with repeated value
@@ -1,33 +1,56 @@
+#!/usr/bin/env python
+
 """
 Generates the results for the CSI screen
 """
+import argparse
 import logging
+import multiprocessing
 from pandas.io.excel import ExcelWriter
 
 logger = logging.getLogger()
 
 from collections import OrderedDict
+import numpy as np
 import pandas as pd
 
 from init_db import *
 from platero.parsing.parsing import parse_plate_results
-from platero.platero import db, db_reset
-from platero.model.models import BatchProtein
-from platero.parsing.parsing import iterate96WP
+from platero.parsing.cache import ReadsCache
+from platero.platero import config, db
+from platero.commands import CliCommand, arg_is_valid_directory, arg_int_in_range
+from platero.model.catalog import ProteinCatalog
+from platero.pool import ProcessingPool, worker_state
+from platero.kinetics import plate_kinetics, KINETIC_COLUMNS
+from platero.export import Crosstab, crosstab_rows, table_rows, threshold_values, write_xlsx, XLS_MAX_ROWS, \
+    categorical_table, write_columnar, columnar_format_available, COLUMNAR_REQUIREMENTS
+from platero.wellplate import GEOMETRIES, get_geometry
 from platero.templates import NEG_CONTROL, POS_CONTROL, TEMPLATE_CELL_RE, DELIMITER
-from platero.utils import find_files, filter_digits, get_batch_ids
+from platero.utils import find_files, filter_digits, get_batch_ids, DataFrameCollector
 
 from platero.parsing.parsing import read_excel_list
 
-RESULTS_FILENAME = 'interactions.xls'
-
-PROTEIN_LABELS = {}
-PROTEIN_FAMILIES = {}
-PROTEIN_SUBFAMILIES = {}
-
-def process_plates(plates_folder, proteins_list, output_folder):
+RESULTS_BASENAME = 'interactions'
+# Export formats and extension of the main results file
+EXPORT_EXTENSIONS = OrderedDict([
+    ('xlsx', '.xlsx'),
+    ('xls', '.xls'),
+    ('parquet', '.parquet'),
+    ('feather', '.feather'),
+    ('hdf5', '.h5'),
+])
+EXPORT_FORMATS = list(EXPORT_EXTENSIONS.keys())
+# Formats that can be written with the installed libraries
+AVAILABLE_EXPORT_FORMATS = [export_format for export_format in EXPORT_FORMATS
+                            if export_format not in COLUMNAR_REQUIREMENTS or columnar_format_available(export_format)]
+
+def process_plates(plates_folder, proteins_list, output_folder, use_cache=True, jobs=1, kinetics=False,
+                   export_format=None):
     '''
-    Generate the CSI screen results with the given input
+    Generate the CSI screen results with the given input. Parsed plate reader
+    files are cached between runs unless use_cache is disabled, and plates are
+    processed by a pool of processes when more than 1 job is requested. If
+    kinetics is enabled, kinetic features over all timepoints are added
     '''
     logger.info("Start plates processing")
 
@@ -40,126 +63,128 @@ def process_plates(plates_folder, proteins_list, output_folder):
         raise NotADirectoryError("Output folder location doesn't exist or is not a folder")
 
 
-    load_proteins_list(proteins_list)
-    df = process_results(plates_folder)
-    export_results(df, output_folder)
+    catalog = load_proteins_list(proteins_list)
+    cache = ReadsCache.from_config(config) if use_cache else None
+    df = process_results(plates_folder, catalog, cache, jobs, kinetics)
+    export_results(df, output_folder, export_format=export_format)
 
     logger.info("Finished plates processing")
 
 def load_proteins_list(filepath):
     '''
-    Reads in the CSI screen list and creates the reference proteins DB
+    Reads in the CSI screen list, creates the reference proteins DB (or
+    restores it if the list didn't change) and returns the catalog of batch
+    proteins
     '''
     logger.info("Loading proteins list from {}".format(filepath))
 
-    with open(filepath, 'rb') as file:
-        db_reset()
-        init_db(file)
+    load_db(filepath)
 
-    # Init global variables
-    for bp in db.query(BatchProtein):
-        PROTEIN_LABELS[bp.protein.id] = bp.protein.label
-        PROTEIN_FAMILIES[bp.protein.id] = bp.protein.family
-        PROTEIN_SUBFAMILIES[bp.protein.id] = bp.protein.subfamily
+    return ProteinCatalog.from_db(db)
 
 
-def export_results(df, outfolder):
-    # Export summary table
+def export_results(df, outfolder, thresholds=None, export_format=None):
+    """
+    Export the screen results, plus a copy of them for each threshold where
+    the normalized values that don't meet the threshold are set to 0. See
+    EXPORT_THRESHOLDS in the config for the format of the thresholds, and
+    EXPORT_FORMAT for the default file format
+    """
     logger.info("Exporting screen interaction results to: {}".format(outfolder))
-    basename = os.path.splitext(RESULTS_FILENAME)[0]
-
-    save_results_file(df, outfolder, basename)
-
-    # TODO: remove this
-    # Export table with cutoffs by old Z-Score
-    filtered = df.copy()
-    stdev = df.Normalized.std()
-
-    # TODO: use 0 or something else?
-    filtered.Normalized = [value if value >= 4*stdev else 0 for value in filtered.Normalized]
-    save_results_file(filtered, outfolder, 'interactions_4xSTD')
-
-    filtered.Normalized = [value if value >= 6*stdev else 0 for value in filtered.Normalized]
-    save_results_file(filtered, outfolder, 'interactions_6xSTD')
-
-    # TODO: remove this
-    # Export table with cutoffs by old Z-Score
-    filtered = df.copy()
-
-    # TODO: use 0 or something else?
-    filtered.ix[df.Z_Score_Old_Plate < 4, 'Normalized'] = 0
-    save_results_file(filtered, outfolder, 'interactions_4xSTD_plate')
-
-    filtered.ix[df.Z_Score_Old_Plate < 6, 'Normalized'] = 0
-    save_results_file(filtered, outfolder, 'interactions_6xSTD_plate')
-
-
-
-    # Export table with cutoffs by Z-Score by plate
-    filtered = df.copy()
+    if thresholds is None:
+        thresholds = config.EXPORT_THRESHOLDS
+    if export_format is None:
+        export_format = config.EXPORT_FORMAT
 
-    filtered.ix[df.Z_Score_Plate < 4, 'Normalized'] = 0
-    save_results_file(filtered, outfolder, '{}_Z4_plate'.format(basename))
+    basename = RESULTS_BASENAME
 
-    filtered.ix[df.Z_Score_Plate < 6, 'Normalized'] = 0
-    save_results_file(filtered, outfolder, '{}_Z6_plate'.format(basename))
+    # Shared by all exports, only the normalized values change
+    table = results_table(df, export_format)
+    crosstab = Crosstab(df)
+    normalized = df.Normalized.values
 
-    # Export table with cutoffs by Z-Score
-    filtered = df.copy()
+    save_results_file(table, crosstab, outfolder, basename, export_format)
 
-    filtered.ix[df.Z_Score < 4, 'Normalized'] = 0
-    save_results_file(filtered, outfolder, '{}_Z4'.format(basename))
+    for suffix, column, cutoff in thresholds:
+        # TODO: use 0 or something else?
+        table['Normalized'] = threshold_values(df, normalized, column, cutoff)
+        save_results_file(table, crosstab, outfolder, '{}_{}'.format(basename, suffix), export_format)
 
-    filtered.ix[df.Z_Score < 6, 'Normalized'] = 0
-    save_results_file(filtered, outfolder, '{}_Z6'.format(basename))
 
+def results_filename(export_format):
+    """ Name of the main results file for an export format """
+    return RESULTS_BASENAME + EXPORT_EXTENSIONS[export_format]
 
 
-def save_results_file(df, outfolder, basename):
+def results_table(df, export_format='xlsx'):
+    """ Columns of the screen data frame exported as the results table """
     # TODO: remove Z_Score_Old
     columns = ['Bait', 'Prey', 'Normalized', 'Value', 'NC', 'Z_Score', 'Z_Score_Plate', 'Z_Score_Old', 'Z_Score_Old_Plate', 'Plate', 'PlateCell',
                'BaitId', '                                                  BaitFamily', 'BaitSubfamily', 'PreyId', 'PreyFamily', 'PreySubfamily', 'InteractionId']
+    # Optional kinetic features go next to the values
+    kinetic_columns = [column for column in KINETIC_COLUMNS if column in df]
+    columns[5:5] = kinetic_columns
 
-    # Generate crosstab data frame for export
-    ctdf = df.sort_values(by=['PreyFamily', 'PreySubfamily']).pivot_table(index=['PreyFamily', 'PreySubfamily', 'Prey'],
-                                                                          columns=['BaitFamily', 'BaitSubfamily',
-                                                                                   'Bait'], values='Normalized')
-    ctdf.reset_index(inplace=True)
-    ctdf.rename(columns={'Prey': 'Prey vs Bait'}, inplace=True)
+    if export_format in ['xlsx', 'xls']:
+        return df.reindex(columns=columns)
+
+    return categorical_table(df.reindex(columns=[column.strip() for column in columns]))
+
+
+def save_results_file(table, crosstab, outfolder, basename, export_format='xlsx'):
+    """
+    Save the results table, and the crosstab of its normalized values, to
+    an excel file. The xlsx format is streamed to disk and split in several
+    sheets if needed, the legacy xls format is limited to 65536 rows. The
+    columnar formats (parquet, feather and hdf5) are meant for loading the
+    results from other tools. Parquet and feather can't be written with the
+    pinned pandas 0.17.1, see AVAILABLE_EXPORT_FORMATS
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format '{}', use one of: {}".format(export_format, ', '.join(EXPORT_FORMATS)))
 
     # Check if missing values
-    n_blanks = ctdf.isnull().sum().sum()
+    matrix = crosstab.matrix(table.Normalized.values)
+    n_blanks = np.isnan(matrix).sum()
     if n_blanks > 0:
         logger.debug("Some interaction comparisons are missing (a total of {}). It means you haven't tested all " \
                         "combinations for the proteins both as bait and prey. These missing values will " \
                         "show up as 0s in the crosstab file format (i.e. gaps in a heatmap). ".format(n_blanks))
 
-    # Fill the blanks with 0s
-    ctdf.fillna(0, inplace=True)
-
-    # NOTE: mini hack to nicefy columns
-    tmpfile = os.path.join(outfolder, '{}_crosstab.csv'.format(basename))
-    ctdf.to_csv(tmpfile, index=False)
-    ctdf = pd.read_csv(tmpfile, header=None, skiprows=[3])
-    ctdf.loc[2, 0:2] = ctdf.loc[0, 0:3]
-    ctdf.loc[0:1, 0:1] = None
-    ctdf.loc[0, 2] = 'BaitFamily'
-    ctdf.loc[1, 2] = 'BaitSubfamily'
-    os.remove(tmpfile)
-
-    outfile = os.path.join(outfolder, '{}.xls'.format(basename))
-    with ExcelWriter(outfile) as writer:
-        df.to_excel(writer, index=False, columns=columns, sheet_name='Table')
-        ctdf.to_excel(writer, index=False, header=None, sheet_name='Crosstab')
-
-
-def process_results(datafolder):
+    if export_format not in ['xlsx', 'xls']:
+        write_columnar(os.path.join(outfolder, basename), export_format, table, crosstab, matrix)
+        return
+
+    outfile = os.path.join(outfolder, basename + EXPORT_EXTENSIONS[export_format])
+    if export_format == 'xlsx':
+        # Fill the blanks with 0s
+        write_xlsx(outfile, [
+            ('Table', table_rows(table), 1),
+            ('Crosstab', crosstab_rows(crosstab, matrix, fill_value=0), 3),
+        ])
+    else:
+        # Fill the blanks with 0s
+        # NOTE: values are written as text, same as in the xls sheets generated so far
+        ctdf = pd.DataFrame(list(crosstab_rows(crosstab, matrix, fill_value=0, as_text=True)))
+
+        # Header row included
+        n_rows = max(len(table) + 1, len(ctdf))
+        if n_rows > XLS_MAX_ROWS:
+            raise ValueError("The results ({} rows) don't fit in the {} rows of an xls sheet, "
+                             "use the xlsx format instead".format(n_rows, XLS_MAX_ROWS))
+
+        with ExcelWriter(outfile) as writer:
+            table.to_excel(writer, index=False, sheet_name='Table')
+            ctdf.to_excel(writer, index=False, header=None, sheet_name='Crosstab')
+
+
+def process_results(datafolder, catalog, cache=None, jobs=1, kinetics=False):
     """
     Reads the screening plates and generates the screen summary dataframe
     """
 
     # Check available files
-    df_files = pd.DataFrame(find_files(datafolder, '^plate_.*_results\.xlsx?$'), columns=['results'])
+    df_files = pd.DataFrame(sorted(find_files(datafolder, '^plate_.*_results\.xlsx?$')), columns=['results'])
     df_files['template'] = df_files.results.replace(to_replace='_results\.xlsx?$', value='_template.xlsx', regex=True)
     df_files['filename'] = [os.path.basename(x) for x in df_files.template]
     df_files['found'] = [os.path.isfile(x) for x in df_files.template]
@@ -169,13 +194,21 @@ def process_results(datafolder):
                     n_lines=0)
 
     # Generate screen summary table
-    df = pd.DataFrame()
+    collector = DataFrameCollector('screen results')
 
-    n_plates = len(df_files)
-    for i, plate in enumerate(df_files.to_dict(orient='records')):
-        logger.info("Processing results plate ({}/{}): {}".format(i + 1, n_plates, plate['results']))
-        results = process_results_plate(plate['results'], plate['template'])
-        df = df.append(results, ignore_index=True)
+    plates = df_files.to_dict(orient='records')
+    n_plates = len(plates)
+    with ProcessingPool(jobs, catalog=catalog, cache=cache, kinetics=kinetics) as pool:
+        # NOTE: results come back in the same order as the plates
+        plates_results = pool.imap(process_plate_task, plates)
+        for i, plate in enumerate(plates):
+            logger.info("Processing results plate ({}/{}): {}".format(i + 1, n_plates, plate['results']))
+            collector.append(next(plates_results))
+
+    df = collector.to_frame()
+
+    # Add protein symbols and families
+    catalog.annotate(df)
 
     #  Add global Z-Score
     add_z_score(df, 'Normalized', 'Z_Score')
@@ -192,9 +225,13 @@ def process_results(datafolder):
     return df
 
 
-def control_index(cell_id):
-    # TODO: what a hack!
-    return (filter_digits(cell_id) - 1) // 6
+def process_plate_task(plate):
+    return process_results_plate(plate['results'], plate['template'], **worker_state)
+
+
+def control_index(cell_id, geometry=GEOMETRIES[96]):
+    ''' Index of the negative control used for a cell (i.e. the half of the plate) '''
+    return int(geometry.half_index[geometry.index[cell_id]])
 
 def validate_half_plate(df, half):
     if len(df.BaitId.unique()) > 1:
@@ -224,53 +261,38 @@ def get_interaction_values(timepoint_reads, template):
     values to controls
     '''
 
-    cell_values = timepoint_reads.ix[:, template.keys()].squeeze().to_dict()
+    cells = list(template.keys())
+    interactions = list(template.values())
+    geometry = get_geometry(len(cells))
+    values = timepoint_reads.ix[:, cells].values[0].astype(float)
+    control_ids = geometry.half_index[geometry.well_indexes(cells)]
+
+    is_control = np.array([interaction == NEG_CONTROL for interaction in interactions], dtype=bool)
+    is_interaction = np.array([type(interaction) == dict for interaction in interactions], dtype=bool)
+    # NOTE: reads in other positions are ignored, as it is expected to happen
+    # when using a multipippette
+    logger.debug("Found {} interactions and {} controls".format(is_interaction.sum(), is_control.sum()))
 
     # Merge protein information from template with read values
-    data = []
-    controls = {}
-    for cell_id, interaction in template.items():
-        if interaction == NEG_CONTROL:
-            controls.setdefault(control_index(cell_id), []).append(cell_values[cell_id])
-            logger.debug("Added control {} ({}, {})".format(cell_values[cell_id],
-                                                             cell_id,
-                                                             control_index(cell_id)))
-        elif type(interaction) == dict:
-            row = {
-                'Value': cell_values[cell_id],
-                'PlateCell': cell_id,
-                'BaitId': interaction['bait'],
-                'PreyId': interaction['prey'],
-                'ControlId': control_index(cell_id),
-            }
-            data.append(row)
-            logger.debug("Added values {} ({})".format(cell_values[cell_id], cell_id))
-
-        # TODO: activate? might cause problems
-        # NOTE: we should ignore this errors, as it is expected to happen when using
-        # a multipippette
-        # elif cell_values[cell_id] > 0:
-        #     raise ValueError("Value ({}) found in unexpected plate position ({})".format(cell_values[cell_id], cell_id))
-
-
-    # Create data frame
-    df = pd.DataFrame(data)
+    selected = np.flatnonzero(is_interaction)
+    df = pd.DataFrame(OrderedDict([
+        ('BaitId', [interactions[i]['bait'] for i in selected]),
+        ('ControlId', control_ids[selected]),
+        ('PlateCell', [cells[i] for i in selected]),
+        ('PreyId', [interactions[i]['prey'] for i in selected]),
+        ('Value', values[selected]),
+    ]))
 
     # Cross validation
     validate_simmetry(df)
 
-    # Add protein symbols
-    protein_labels = {bp.protein.id: bp.protein.label for bp in db.query(BatchProtein)}
-    df['Bait'] = df.BaitId.map(PROTEIN_LABELS)
-    df['Prey'] = df.PreyId.map(PROTEIN_LABELS)
-    df['BaitFamily'] = df.BaitId.map(PROTEIN_FAMILIES)
-    df['BaitSubfamily'] = df.BaitId.map(PROTEIN_SUBFAMILIES)
-    df['PreyFamily'] = df.PreyId.map(PROTEIN_FAMILIES)
-    df['PreySubfamily'] = df.PreyId.map(PROTEIN_SUBFAMILIES)
-
-    # Calculate and add normalized values
-    controls = {i: (sum(controls[i]) / len(controls[i])) for i in controls}
-    df['NC'] = df.ControlId.map(controls)
+    # Calculate and add normalized values (mean of the controls of each half)
+    n_halves = control_ids.max() + 1
+    sums = np.bincount(control_ids[is_control], weights=values[is_control], minlength=n_halves)
+    counts = np.bincount(control_ids[is_control], minlength=n_halves)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        controls = sums / counts
+    df['NC'] = controls[df.ControlId.values]
     if any(df.NC.isnull()):
         raise ValueError("No negative control found on the template. Make sure there is a [NC] value for each part of the plate")
 
@@ -303,7 +325,7 @@ def parse_interaction(text):
     return dict(zip(['bait', 'prey'], m.groups()))
 
 
-def parse_plate_template(filepath):
+def parse_plate_template(filepath, catalog):
     """
     Process a template file, returning an ordered dictionary
     TODO:
@@ -319,10 +341,10 @@ def parse_plate_template(filepath):
         ws = wb.get_sheet_by_name('Template')
         cells = ws.get_named_range('rng_template_proteins')
 
-        # TODO: support multiple plate sizes via metadata or guessing?
+        # NOTE: the plate geometry is guessed from the size of the range
+        geometry = get_geometry(len(cells))
         template = OrderedDict()
-        for position, cell in zip(iterate96WP(), cells):
-            cell_id = position[0]
+        for cell_id, cell in zip(geometry.names, cells):
             template[cell_id] = parse_interaction(cell.value)
 
     except Exception as exc:
@@ -339,24 +361,30 @@ def parse_plate_template(filepath):
             baits.add(template[k]['bait'])
             preys.add(template[k]['prey'])
 
-    for bait in baits:
-        if db.query(BatchProtein.protein_id).filter(BatchProtein.protein_id == bait, BatchProtein.batch_id == bait_batch_id).count() == 0:
-            raise ValueError("Protein '{}' was used as a BAIT on the template, but it can't be found on batch #{}".format(bait, bait_batch_id))
+    missing_baits = catalog.missing_from_batch(baits, bait_batch_id)
+    if missing_baits:
+        raise ValueError("Protein '{}' was used as a BAIT on the template, but it can't be found on batch #{}".format(
+            "', '".join(missing_baits), bait_batch_id))
 
-    for prey in preys:
-        if db.query(BatchProtein.protein_id).filter(BatchProtein.protein_id == prey, BatchProtein.batch_id == prey_batch_id).count() == 0:
-            raise ValueError("Protein '{}' was used as a PREY on the template, but it can't be found on batch #{}".format(prey, prey_batch_id))
+    missing_preys = catalog.missing_from_batch(preys, prey_batch_id)
+    if missing_preys:
+        raise ValueError("Protein '{}' was used as a PREY on the template, but it can't be found on batch #{}".format(
+            "', '".join(missing_preys), prey_batch_id))
 
     return template, info
 
 
-def process_results_plate(results_path, template_path):
+def process_results_plate(results_path, template_path, catalog, cache=None, kinetics=False):
     """
-    Process a single results plate and return the interaction data
+    Process a single results plate and return the interaction data, with the
+    kinetic features of each well if requested
     """
-    reads, plate_info = parse_plate_results(results_path)
+    if cache:
+        reads, plate_info = cache.parse_plate_results(results_path)
+    else:
+        reads, plate_info = parse_plate_results(results_path)
 
-    template, template_info = parse_plate_template(template_path)
+    template, template_info = parse_plate_template(template_path, catalog)
 
     # Get reads for specified timepoint
     timeshift = template_info['Timeshift']
@@ -376,7 +404,47 @@ def process_results_plate(results_path, template_path):
                     columns=['PlateCell', 'BaitId', 'PreyId', 'Value'])
 
 
+    if kinetics:
+        features = plate_kinetics(reads, df.PlateCell, config.KINETICS_THRESHOLD)
+        for column, values in features.items():
+            df[column] = values
+
     # TODO: very hackish!!! use template info instead (currently not available in templates for batch 1)
     df['Plate'] = filter_digits(results_path.split('/plate_')[1].split('_')[0])
 
     return df
+
+
+class ProcessPlates(CliCommand):
+    short_description = "Process the screen plates and export the interaction results"
+
+    @classmethod
+    def _arg_parser(cls):
+        parser = argparse.ArgumentParser(description='Process the screen plates and export the interaction results')
+        parser.add_argument('plates_folder', type=lambda x: arg_is_valid_directory(parser, x),
+                            help='Path to directory where the plate templates and results are stored')
+        parser.add_argument('proteins_list',
+                            help='An excel file containing the proteins list')
+        parser.add_argument('output_folder', type=lambda x: arg_is_valid_directory(parser, x),
+                            help='Path to directory where the results will be saved')
+        parser.add_argument('-j', '--jobs', type=lambda x: arg_int_in_range(parser, x, min=1), default=1,
+                            help='Number of plates processed in parallel')
+        parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                            help="Don't use the cache of parsed plate reader files")
+        parser.add_argument('-f', '--format', dest='export_format', choices=AVAILABLE_EXPORT_FORMATS, default=None,
+                            help='File format of the exported results (default: {})'.format(config.EXPORT_FORMAT))
+        parser.add_argument('-k', '--kinetics', action='store_true',
+                            help='Add kinetic features (slope, AUC, max signal, time to threshold) computed over all timepoints')
+
+        return parser
+
+    @classmethod
+    def _main(cls, args):
+        process_plates(args.plates_folder, args.proteins_list, args.output_folder,
+                       use_cache=args.use_cache, jobs=args.jobs, kinetics=args.kinetics,
+                       export_format=args.export_format)
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    ProcessPlates.run()
@@ -13,29 +13,18 @@ import os
 import pandas as pd
 
 from platero.commands import CliCommand, arg_is_valid_directory
-from platero.utils import find_files
+from platero.utils import find_files, DataFrameCollector
 from platero.parsing.parsing import parse_plate_results
 
 from platero.platero import db
-from platero.model.models import Plate, PlateCell, BatchProtein
-from platero.parsing.parsing import iterate96WP
+from platero.model.catalog import ProteinCatalog
+from platero.wellplate import GEOMETRIES, get_geometry
 from platero.templates import NEG_CONTROL, POS_CONTROL, DELIMITER, DELIMITER_RE
 
 
-PROTEIN_LABELS = {}
-PROTEIN_FAMILIES = {}
-PROTEIN_SUBFAMILIES = {}
-
-for bp in db.query(BatchProtein):
-    PROTEIN_LABELS[bp.protein.id] = bp.protein.label
-    PROTEIN_FAMILIES[bp.protein.id] = bp.protein.family
-    PROTEIN_SUBFAMILIES[bp.protein.id] = bp.protein.subfamily
-
-
 from platero.utils import filter_digits
-def control_index(cell_id):
-    # TODO: what a hack!
-    return (filter_digits(cell_id) - 1) // 6
+def control_index(cell_id, geometry=GEOMETRIES[96]):
+    return int(geometry.half_index[geometry.index[cell_id]])
 
 def get_interaction_values(reads, timepoint, template):
     '''
@@ -48,23 +37,24 @@ def get_interaction_values(reads, timepoint, template):
     if timepoint_reads.empty:
         raise ValueError('Invalid timepoint ({}) for provided plate reads'.format(timepoint))
     cell_values = timepoint_reads.ix[:, template.keys()].squeeze().to_dict()
+    geometry = get_geometry(len(template))
 
     # Merge protein information from template with read values
     data = []
     controls = {}
     for cell_id, interaction in template.items():
         if interaction == NEG_CONTROL:
-            controls.setdefault(control_index(cell_id), []).append(cell_values[cell_id])
+            controls.setdefault(control_index(cell_id, geometry), []).append(cell_values[cell_id])
             logging.debug("Added control {} ({}, {})".format(cell_values[cell_id],
                                                      cell_id,
-                                                     control_index(cell_id)))
+                                                     control_index(cell_id, geometry)))
         elif type(interaction) == dict:
             row = {
                 'Value': cell_values[cell_id],
                 'PlateCell': cell_id,
                 'BaitId': interaction['bait'],
                 'PreyId': interaction['prey'],
-                'ControlId': control_index(cell_id),
+                'ControlId': control_index(cell_id, geometry),
             }
             data.append(row)
             logging.debug("Added values {} ({})".format(cell_values[cell_id], cell_id))
@@ -76,15 +66,6 @@ def get_interaction_values(reads, timepoint, template):
         print(df[df.Value <= 0])
         logging.warning("Some reads in the plate contain invalid values (<=0)!")
 
-    # Add protein symbols
-    protein_labels = {bp.protein.id:bp.protein.label for bp in db.query(BatchProtein)}
-    df['Bait'] = df.BaitId.map(PROTEIN_LABELS)
-    df['Prey'] = df.PreyId.map(PROTEIN_LABELS)
-    df['BaitFamily'] = df.BaitId.map(PROTEIN_FAMILIES)
-    df['BaitSubfamily'] = df.BaitId.map(PROTEIN_SUBFAMILIES)
-    df['PreyFamily'] = df.PreyId.map(PROTEIN_FAMILIES)
-    df['PreySubfamily'] = df.PreyId.map(PROTEIN_SUBFAMILIES)
-
     # Calculate and add normalized values
     controls = {i:(sum(controls[i])/len(controls[i])) for i in controls}
     df['NC'] = df.ControlId.map(controls)
@@ -117,10 +98,9 @@ def parse_plate_template(filepath):
     ws = wb.get_sheet_by_name('Template')
     cells = ws.get_named_range('rng_template_proteins')
 
-    # TODO: support multiple plate sizes via metadata or guessing?
+    geometry = get_geometry(len(cells))
     template = OrderedDict()
-    for position, cell in zip(iterate96WP(), cells):
-        cell_id = position[0]
+    for cell_id, cell in zip(geometry.names, cells):
         template[cell_id] = parse_interaction(cell.value)
 
     return template, info
@@ -183,7 +163,7 @@ def process_results(datafolder, outfolder):
     """
 
     # Generate screen summary table
-    df = pd.DataFrame()
+    collector = DataFrameCollector('screen results')
 
     for results_path in find_files(datafolder, '^plate_.*_results\.xlsx?$'):
         logging.info("Processing results file: {}".format(results_path))
@@ -194,7 +174,12 @@ def process_results(datafolder, outfolder):
            continue
 
         results = process_results_plate(results_path, template_path)
-        df = df.append(results, ignore_index=True)
+        collector.append(results)
+
+    df = collector.to_frame()
+
+    # Add protein symbols and families
+    ProteinCatalog.from_db(db).annotate(df)
 
     # TODO: Deal with repeated compared values? (averages?)
     # Export summary table
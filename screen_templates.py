@@ -5,57 +5,137 @@ Generate the screening templates for the specified batches
 """
 
 import os
+import multiprocessing
 import logging
 import argparse
 
-from sqlalchemy import func
-from platero.commands import CliCommand, arg_is_valid_directory
-from platero.model.queries import get_batch_proteins, get_plates
+from platero.assets import xls_template, xls_template_sizes
+from platero.commands import CliCommand, arg_is_valid_directory, arg_int_in_range
+from platero.model.queries import get_batch_protein_rows, get_plates, reserve_plate_ids, delete_plates
+from platero.pool import ProcessingPool
+from platero.utils import chunks
 
 from platero.wellplate import *
-from platero.model.models import BatchProtein, Plate
 from platero.model.naming import *
-from platero.platero import db, config
-from platero.templates import export_storage_plate, export_screen_plate
+from platero.templates import export_screen_plates, get_template_archive, RENDER_BATCH_SIZE
 from storage_templates import arg_batch_ids
 
-def create_screen_plates(bait_batch_id, prey_batch_id, outfolder):
+def screen_plate_tasks(bait_batch_id, prey_batch_id, outfolder, geometry=GEOMETRIES[96]):
+    """
+    Add the screen plates for a pair of batches to the database (one per 2
+    bait proteins), returning the task to render the template of each plate
+    (see screen_plate_export)
+    """
+    # NOTE: parsed before adding any plate, so a missing template fails early
+    get_template_archive(xls_template('screen', geometry.size))
+
+    prey_prots = get_batch_protein_rows(prey_batch_id)
+    bait_prots = get_batch_protein_rows(bait_batch_id)
+
+    # 2 bait proteins per plate
+    capacity = ScreenPlate.capacity(geometry)
+    starts = range(0, len(bait_prots), capacity)
+    plate_ids = reserve_plate_ids(bait_batch_id, prey_batch_id, len(starts))
+
+    tasks = []
+    for plate_id, i in zip(plate_ids, starts):
+        tasks.append({
+            'plate_id': plate_id,
+            'bait_batch_id': bait_batch_id,
+            'prey_batch_id': prey_batch_id,
+            'baits': bait_prots[i:i + capacity],
+            'bait_index': i,
+            'preys': prey_prots,
+            'plate_size': geometry.size,
+            'outfolder': outfolder,
+        })
+
+    return tasks
+
+
+# Prey storage plates of the worker, by prey batch and plate size
+_prey_plates = {}
+
+def get_prey_plate(prey_batch_id, prey_prots, geometry):
+    """ Same prey plate for all the screen plates of a prey batch """
+    key = (prey_batch_id, geometry.size)
+    if key not in _prey_plates:
+        prey_plate = PreyStoragePlate(prey_prots, geometry)
+        prey_plate.name = storage_prey_plate_name(prey_batch_id)
+        _prey_plates[key] = prey_plate
+
+    return _prey_plates[key]
+
+
+def screen_plate_export(task):
+    """ Screen plate of a rendering task, as (template file, plate, metadata) """
+    geometry = get_geometry(task['plate_size'])
+    bait_batch_id, prey_batch_id, i = task['bait_batch_id'], task['prey_batch_id'], task['bait_index']
+    prey_plate = get_prey_plate(prey_batch_id, task['preys'], geometry)
+
+    bait_plate_name = storage_bait_plate_name(bait_batch_id, BaitStoragePlate.bait_plate_index(i, geometry))
+    screen_plate = ScreenPlate(task['baits'], bait_plate_name, BaitStoragePlate.bait_plate_offset(i, geometry), prey_plate)
+    screen_plate.name = screen_plate_name(task['plate_id'])
+
     metadata = OrderedDict()
-    metadata['Plate name'] = ''
+    metadata['Plate name'] = screen_plate.name
     metadata['Plate type'] = 'Screen'
     metadata['Timeshift'] = ''
-    metadata['Bait plate'] = ''
-    metadata['Prey plate'] = storage_prey_plate_name(prey_batch_id)
+    metadata['Bait plate'] = bait_plate_name
+    metadata['Prey plate'] = screen_plate.prey_plate_name
 
-    # Same prey plate for all screen plates
-    prey_prots = get_batch_proteins(prey_batch_id)
-    prey_plate = PreyStoragePlate(prey_prots)
-    prey_plate.name = storage_prey_plate_name(prey_batch_id)
+    return screen_template_file(task), screen_plate, metadata
+
+
+def screen_template_file(task):
+    """ Path of the template of a screen plate task """
+    return os.path.join(task['outfolder'], '{}_b{:02d}_p{:02d}_template.xlsx'.format(
+        screen_plate_name(task['plate_id']), task['bait_batch_id'], task['prey_batch_id']))
+
+
+def render_screen_batch(tasks):
+    """ Write the templates of a batch of screen plates, returning the template files """
+    return list(export_screen_plates(screen_plate_export(task) for task in tasks))
+
+
+def render_screen_plates(tasks, jobs=1):
+    """
+    Write the templates of the screen plates, in parallel with several jobs.
+    If any template fails, the plates of all the tasks are removed from the
+    database, along with the templates already written, so the batches
+    aren't taken as already generated
+    """
+    template_files = []
+    try:
+        with ProcessingPool(jobs) as pool:
+            for batch_files in pool.imap(render_screen_batch, chunks(tasks, RENDER_BATCH_SIZE)):
+                for template_file in batch_files:
+                    logging.info("Saved screen template to {}".format(template_file))
+                    template_files.append(template_file)
+    except Exception:
+        release_plates(tasks)
+        raise
+
+    return template_files
 
-    # 2 bait proteins per plate
 
-    bait_prots = get_batch_proteins(bait_batch_id)
-    for i in range(0, len(bait_prots), ScreenPlate.capacity()):
-        plate = Plate(bait_batch_id=bait_batch_id, prey_batch_id=prey_batch_id)
-        db.add(plate)
-        db.flush()
-        baits = bait_prots[i:i + ScreenPlate.capacity()]
+def release_plates(tasks):
+    """
+    Remove the plates of the rendering tasks from the database, and their
+    templates if written, as the plate ids will be used again
+    """
+    logging.error("Removing the {} screen plates added for the templates".format(len(tasks)))
+    delete_plates([task['plate_id'] for task in tasks])
 
-        bait_plate_name = storage_bait_plate_name(bait_batch_id, BaitStoragePlate.bait_plate_index(i))
-        screen_plate = ScreenPlate(baits, bait_plate_name, BaitStoragePlate.bait_plate_offset(i), prey_plate)
-        screen_plate.name = screen_plate_name(plate.id)
+    for task in tasks:
+        template_file = screen_template_file(task)
+        if os.path.exists(template_file):
+            os.remove(template_file)
 
-        metadata['Plate name'] = screen_plate.name
-        metadata['Bait plate'] = bait_plate_name
-        metadata['Prey plate'] = screen_plate.prey_plate_name
-        template_file = os.path.join(outfolder, '{}_b{:02d}_p{:02d}_template.xlsx'.format(
-            screen_plate.name, bait_batch_id, prey_batch_id))
-        export_screen_plate(template_file, screen_plate, metadata)
-        logging.info("Saved screen template to {}".format(template_file))
 
-        # Save to database
-        db.commit()
-        # TODO: save template?
+def create_screen_plates(bait_batch_id, prey_batch_id, outfolder, geometry=GEOMETRIES[96], jobs=1):
+    tasks = screen_plate_tasks(bait_batch_id, prey_batch_id, outfolder, geometry)
+    return render_screen_plates(tasks, jobs)
 
 
 class ScreenTemplates(CliCommand):
@@ -70,21 +150,36 @@ class ScreenTemplates(CliCommand):
                             help='Id(s) of the batch(es) to use as PREY. Multiple ids can be specified as a comma separated list')
         parser.add_argument('outfolder', type=lambda x: arg_is_valid_directory(parser, x),
                             help='Path to directory where the templates will be saved')
+        parser.add_argument('-s', '--plate-size', type=int, choices=xls_template_sizes('screen', GEOMETRIES), default=96,
+                            help='Number of wells of the plates (default: 96)')
+        parser.add_argument('-j', '--jobs', type=lambda x: arg_int_in_range(parser, x, min=1), default=1,
+                            help='Number of parallel jobs writing the templates (default: 1)')
 
         return parser
 
     @classmethod
     def _main(cls, args):
-        for bait_batch_id in args.bait_ids:
-            for prey_batch_id in args.prey_ids:
-                if get_plates(bait_batch_id, prey_batch_id).count():
-                    logging.info("Skipped screen templates for batches {} vs {}, already generated".format(
-                                 bait_batch_id, prey_batch_id))
-                else:
-                    logging.info("Generating screen templates for batches {} vs {}".format(
-                                 bait_batch_id, prey_batch_id))
-                    create_screen_plates(bait_batch_id, prey_batch_id, args.outfolder)
+        # NOTE: the plates of all the batches are added first, so that the
+        # templates of the whole batch matrix are written in a single pool
+        tasks = []
+        try:
+            for bait_batch_id in args.bait_ids:
+                for prey_batch_id in args.prey_ids:
+                    if get_plates(bait_batch_id, prey_batch_id).count():
+                        logging.info("Skipped screen templates for batches {} vs {}, already generated".format(
+                                     bait_batch_id, prey_batch_id))
+                    else:
+                        logging.info("Generating screen templates for batches {} vs {}".format(
+                                     bait_batch_id, prey_batch_id))
+                        tasks.extend(screen_plate_tasks(bait_batch_id, prey_batch_id, args.outfolder,
+                                                        get_geometry(args.plate_size)))
+        except Exception:
+            release_plates(tasks)
+            raise
+
+        render_screen_plates(tasks, args.jobs)
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     ScreenTemplates.run()
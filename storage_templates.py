@@ -5,55 +5,112 @@ Generate the storage templates for the specified batches
 """
 
 import os
+import multiprocessing
+import csv
 import argparse
 import logging
 from collections import OrderedDict
+from time import time
 
-from platero.commands import CliCommand, arg_is_valid_directory
+from platero.assets import xls_template, xls_template_sizes
+from platero.commands import CliCommand, arg_is_valid_directory, arg_int_in_range
+from platero.pool import ProcessingPool
+from platero.utils import chunks
 
-from platero.wellplate import PreyStoragePlate, BaitStoragePlate
-from platero.model.queries import get_batch_proteins
+from platero.wellplate import PreyStoragePlate, BaitStoragePlate, GEOMETRIES, get_geometry
+from platero.model.queries import get_batch_protein_rows
 from platero.model.naming import batch_name, storage_prey_plate_name, storage_bait_plate_name
-from platero.templates import export_storage_plate
+from platero.templates import export_storage_plates, get_template_archive, RENDER_BATCH_SIZE
 
-def create_storage_templates(batch_id, outfolder):
-    proteins = get_batch_proteins(batch_id)
+MANIFEST_FILENAME = 'storage_templates_manifest.csv'
+MANIFEST_COLUMNS = ['batch_id', 'plate_name', 'plate_type', 'template_file', 'seconds']
 
-    # Prey storage plate
-    prey_plate = PreyStoragePlate(proteins)
-    prey_plate.name = storage_prey_plate_name(batch_id)
+
+def storage_plate_tasks(batch_id, outfolder, geometry=GEOMETRIES[96]):
+    """
+    Tasks to render the templates of the storage plates of a batch: the prey
+    plate and the bait plates (see storage_plate_export)
+    """
+    proteins = get_batch_protein_rows(batch_id)
+    task = {'batch_id': batch_id, 'plate_size': geometry.size, 'outfolder': outfolder}
+
+    tasks = [dict(task, plate_type='Prey storage', proteins=proteins, index=0)]
+    capacity = BaitStoragePlate.capacity(geometry)
+    for i in range(0, len(proteins), capacity):
+        tasks.append(dict(task, plate_type='Bait storage', proteins=proteins[i:i + capacity], index=i))
+
+    return tasks
+
+
+def storage_plate_export(task):
+    """ Storage plate of a rendering task, as (template file, plate, metadata) """
+    geometry = get_geometry(task['plate_size'])
+    batch_id = task['batch_id']
+
+    if task['plate_type'] == 'Prey storage':
+        plate = PreyStoragePlate(task['proteins'], geometry)
+        plate.name = storage_prey_plate_name(batch_id)
+    else:
+        plate = BaitStoragePlate(task['proteins'], geometry)
+        plate.name = storage_bait_plate_name(batch_id, BaitStoragePlate.bait_plate_index(task['index'], geometry))
 
     metadata = OrderedDict()
-    metadata['Plate name'] = prey_plate.name
-    metadata['Plate type'] = 'Prey storage'
+    metadata['Plate name'] = plate.name
+    metadata['Plate type'] = task['plate_type']
     metadata['Batch name'] = batch_name(batch_id)
-    template_file = os.path.join(outfolder, '{}.xlsx'.format(prey_plate.name))
-    logging.info("Saved storage template to {}".format(template_file))
-    export_storage_plate(template_file, prey_plate, metadata)
+    template_file = os.path.join(task['outfolder'], '{}.xlsx'.format(plate.name))
+
+    return template_file, plate, metadata
+
 
-    # Bait storage plates
-    metadata = OrderedDict({
-        'Plate name': '',
-        'Plate type': 'Bait storage',
-        'Batch name': batch_name(batch_id)
-    })
+def render_storage_batch(tasks):
+    """ Write the templates of a batch of storage plates, returning their manifest entries """
+    exports = [storage_plate_export(task) for task in tasks]
+    written = export_storage_plates(exports)
 
-    bait_plates = []
-    for i in range(0, len(proteins), BaitStoragePlate.capacity()):
-        baits = proteins[i:i + BaitStoragePlate.capacity()]
+    manifest = []
+    for task, (template_file, plate, metadata) in zip(tasks, exports):
+        start = time()
+        next(written)
+        manifest.append(OrderedDict(zip(MANIFEST_COLUMNS, [task['batch_id'], plate.name, task['plate_type'],
+                                                           template_file, round(time() - start, 4)])))
 
-        bait_plate = BaitStoragePlate(baits)
-        bait_plate.name = storage_bait_plate_name(batch_id, BaitStoragePlate.bait_plate_index(i))
-        bait_plates.append(bait_plate)
+    return manifest
 
-        # print(bait_plate)
-        metadata['Plate name'] = bait_plate.name
-        template_file = os.path.join(outfolder, '{}.xlsx'.format(bait_plate.name))
-        export_storage_plate(template_file, bait_plate, metadata)
-        logging.info("Saved storage template to {}".format(template_file))
 
-    return prey_plate, bait_plates
+def render_storage_plates(tasks, jobs=1):
+    """
+    Write the templates of the storage plates, in parallel with several
+    jobs, returning the manifest entry of each template
+    """
+    # NOTE: parsed before starting the workers, so a missing template fails early
+    for size in set(task['plate_size'] for task in tasks):
+        get_template_archive(xls_template('storage', size))
 
+    manifest = []
+    with ProcessingPool(jobs) as pool:
+        for entries in pool.imap(render_storage_batch, chunks(tasks, RENDER_BATCH_SIZE)):
+            for entry in entries:
+                logging.info("Saved storage template to {template_file} ({seconds:.3f} s)".format(**entry))
+                manifest.append(entry)
+
+    return manifest
+
+
+def write_manifest(filepath, manifest):
+    """ Save the list of written templates and their timings as csv """
+    with open(filepath, 'w', newline='') as file:
+        writer = csv.DictWriter(file, MANIFEST_COLUMNS)
+        writer.writeheader()
+        writer.writerows(manifest)
+
+    logging.info("Wrote {} storage templates in {:.3f} s of rendering, manifest saved to {}".format(
+        len(manifest), sum(entry['seconds'] for entry in manifest), filepath))
+
+
+def create_storage_templates(batch_id, outfolder, geometry=GEOMETRIES[96], jobs=1):
+    tasks = storage_plate_tasks(batch_id, outfolder, geometry)
+    return render_storage_plates(tasks, jobs)
 
 
 class BatchStorageTemplates(CliCommand):
@@ -67,13 +124,21 @@ class BatchStorageTemplates(CliCommand):
                                   'Multiple ids can be specified as a comma separated list'))
         parser.add_argument('outfolder', type=lambda x: arg_is_valid_directory(parser, x),
                             help='Path to directory where the templates will be saved')
+        parser.add_argument('-s', '--plate-size', type=int, choices=xls_template_sizes('storage', GEOMETRIES), default=96,
+                            help='Number of wells of the plates (default: 96)')
+        parser.add_argument('-j', '--jobs', type=lambda x: arg_int_in_range(parser, x, min=1), default=1,
+                            help='Number of parallel jobs writing the templates (default: 1)')
         return parser
 
     @classmethod
     def _main(cls, args):
+        tasks = []
         for batch_id in args.batch_ids:
             logging.info("Generating storage templates for batch {}".format(batch_id))
-            create_storage_templates(batch_id, args.outfolder)
+            tasks.extend(storage_plate_tasks(batch_id, args.outfolder, get_geometry(args.plate_size)))
+
+        manifest = render_storage_plates(tasks, args.jobs)
+        write_manifest(os.path.join(args.outfolder, MANIFEST_FILENAME), manifest)
 
 def arg_batch_ids(parser, arg):
     try:
@@ -83,4 +148,5 @@ def arg_batch_ids(parser, arg):
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     BatchStorageTemplates.run()
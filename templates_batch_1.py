@@ -10,7 +10,7 @@ import pandas as pd
 
 from platero.commands import CliCommand, arg_is_valid_directory
 from platero.platero import db
-from platero.model.queries import get_batch_proteins, save_template
+from platero.model.queries import get_batch_protein_rows, save_templates
 from platero.model.naming import screen_plate_name
 from platero.model.models import Plate, PlateCell
 from platero.parsing.parsing import iterate96WP, reverse
@@ -119,7 +119,7 @@ def plates_first_batch(first_batch_list, outfolder):
 
     plates, base_template = parse_1st_batch_list(first_batch_list)
     # Index ids for batch, by sybmol
-    proteins = get_batch_proteins(batch_id)
+    proteins = get_batch_protein_rows(batch_id)
     prots_by_symbol = {protein.symbol:protein for protein in proteins}
 
     replace_prey_symbols(base_template, prots_by_symbol)
@@ -129,6 +129,13 @@ def plates_first_batch(first_batch_list, outfolder):
                            Plate.prey_batch_id==batch_id
                            ).delete()
 
+    # Save plates to database
+    # NOTE: a plain insert, so plates of other batches with the same ids are never overwritten
+    db.execute(Plate.__table__.insert(), [{'id': id + 1, 'bait_batch_id': batch_id, 'prey_batch_id': batch_id}
+                                          for id in range(len(plates))])
+    db.commit()
+
+    templates = []
     for id, plate in enumerate(plates):
         bait_1 = prots_by_symbol.get(plate['Bait_1'], None)
         bait_2 = prots_by_symbol.get(plate['Bait_2'], None)
@@ -144,15 +151,14 @@ def plates_first_batch(first_batch_list, outfolder):
         metadata['Batch 1 file'] = plate['filename']
         metadata['Timeshift'] = plate['timepoint']
 
-        # Save plate to database
-        plate = Plate(id=plate_id, bait_batch_id=batch_id, prey_batch_id=batch_id)
-        db.add(plate)
-        db.commit()
-        save_template(plate_id, template)
+        templates.append((plate_id, template))
 
         # TODO: export plate from database?
         export_1st_batch_plate(plate_name, template, metadata, outfolder)
 
+    # Save the plate cells to database
+    save_templates(templates)
+
 
 
 class PlatesFirstBatch(CliCommand):